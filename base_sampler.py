@@ -0,0 +1,100 @@
+from functools import lru_cache
+
+import numpy as np
+
+from param_def import ParamDef
+from param_set import ParamSet
+from wing_bounds import BoundsRect
+
+AXES = ["x", "y"]
+
+@lru_cache(maxsize=256)
+def feasible_region(
+        const:float,
+        lower:float,
+        upper:float,
+        num_veins:int,
+        linear_range:tuple[float, float],
+        quadratic_range:tuple[float, float]) -> np.ndarray:
+    """Vertices of the (linear, quadratic) values that keep every root inside
+    (lower, upper) along one axis, in order around a convex polygon. Empty if
+    there are none.
+
+    Root i sits at const + linear * i + quadratic * i^2, so each root adds two
+    half-planes, which are cut from the rectangle of the parameter ranges.
+    Regions are cached, as only the constant terms and vein count usually
+    change between calls; the result is read-only."""
+    (l0, l1), (q0, q1) = linear_range, quadratic_range
+    polygon = [(l0, q0), (l1, q0), (l1, q1), (l0, q1)]
+    for i in range(1, num_veins + 1):
+        polygon = _clip(polygon, i, i * i, upper - const)
+        polygon = _clip(polygon, -i, -i * i, const - lower)
+        if len(polygon) < 3:
+            return np.empty((0, 2))
+    result = np.array(polygon, dtype=float)
+    # Strict inequalities, so a region squeezed to a line is no region.
+    x, y = result.T
+    if np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)) <= 0:
+        result = np.empty((0, 2))
+    result.flags.writeable = False
+    return result
+
+def sample_polygon(polygon:np.ndarray, rng:np.random.Generator, size:int = 1) -> np.ndarray:
+    """Points drawn uniformly from a convex polygon, as a (size, 2) array."""
+    # Fan the polygon into triangles and pick them in proportion to area.
+    a = polygon[0]
+    b = polygon[1:-1]
+    c = polygon[2:]
+    ab, ac = b - a, c - a
+    areas = np.abs(ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0])
+    triangle = rng.choice(len(areas), size=size, p=areas / areas.sum())
+    r = rng.uniform(size=(size, 2))
+    # Points past the diagonal are folded back into the triangle.
+    outside = r.sum(axis=1) > 1
+    r[outside] = 1 - r[outside]
+    return a + r[:, :1] * ab[triangle] + r[:, 1:] * ac[triangle]
+
+def sample_base_parameters(
+        parameters:ParamSet,
+        param_defs:dict[str, ParamDef],
+        bounds_rect:BoundsRect,
+        offset,
+        rng:np.random.Generator) -> bool:
+    """Set the linear and quadratic root position parameters to values drawn
+    uniformly from those that keep every root strictly inside `bounds_rect`,
+    for the current vein count and constant terms. Returns False and leaves
+    the parameters as they were if no values fit."""
+    num_veins = int(parameters['num_root_segments'])
+    lower = np.subtract(bounds_rect.topleft, offset)
+    upper = np.subtract(bounds_rect.bottomright, offset)
+    values = {}
+    for axis, name in enumerate(AXES):
+        linear = f"root_segment_pos_linear_{name}"
+        quadratic = f"root_segment_pos_quadratic_{name}"
+        polygon = feasible_region(
+            float(parameters[f"root_segment_pos_const_{name}"]), # type: ignore[literal-required]
+            float(lower[axis]), float(upper[axis]), num_veins,
+            tuple(param_defs[linear].range), tuple(param_defs[quadratic].range))
+        if len(polygon) == 0:
+            return False
+        values[linear], values[quadratic] = sample_polygon(polygon, rng)[0]
+
+    for name, value in values.items():
+        parameters[name] = float(value) # type: ignore[literal-required]
+    return True
+
+def _clip(polygon:list[tuple[float, float]], a:float, b:float, limit:float) -> list:
+    """The part of a convex polygon where `a * x + b * y <= limit`. Polygons
+    here have a handful of vertices, so plain floats beat NumPy."""
+    distance = [a * x + b * y - limit for x, y in polygon]
+    result = []
+    for k, (x, y) in enumerate(polygon):
+        d = distance[k]
+        next_x, next_y = polygon[k - len(polygon) + 1]
+        next_d = distance[k - len(polygon) + 1]
+        if d <= 0:
+            result.append((x, y))
+        if (d <= 0) != (next_d <= 0):
+            t = d / (d - next_d)
+            result.append((x + (next_x - x) * t, y + (next_y - y) * t))
+    return result
@@ -0,0 +1,190 @@
+from typing import Dict
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from collision_detector import is_adjacent, segment_intersections
+from param_def import ParamDef
+from param_set import ParamSet
+from vein_grower import BOUNDS_CONSTRAINT, COLLISION_CONSTRAINT, LENGTH_CONSTRAINT
+from vein_tree import num_generations, quadratic_param_to_array, segment_directions
+from wing_bounds import BoundsRect
+
+BOX_PADDING = 1e-6
+
+class CandidateBatch:
+    """Candidate parameter sets, with each randomized value as an array."""
+
+    def __init__(self, parameters:dict, size:int):
+        self.parameters = parameters
+        self.size = size
+
+    def candidate(self, k:int) -> ParamSet:
+        result = {}
+        for name, value in self.parameters.items():
+            result[name] = float(value[k]) if isinstance(value, np.ndarray) else value
+        return ParamSet(**result)
+
+    def subset(self, keep:np.ndarray) -> 'CandidateBatch':
+        parameters = {
+            name: value[keep] if isinstance(value, np.ndarray) else value
+            for name, value in self.parameters.items()}
+        return CandidateBatch(parameters, int(np.count_nonzero(keep)))
+
+    def expanded(self, ndim:int) -> dict:
+        """Parameters with `ndim` unit axes after the batch axis, for broadcasting."""
+        return {
+            name: value.reshape((-1,) + (1,) * ndim) if isinstance(value, np.ndarray) else value
+            for name, value in self.parameters.items()}
+
+def draw_candidates(
+        parameters:ParamSet,
+        param_defs:Dict[str, ParamDef],
+        param_names:list[str],
+        size:int,
+        rng:np.random.Generator) -> CandidateBatch:
+    """Draw every named parameter uniformly from its range for `size` candidates."""
+    batch_parameters = dict(parameters)
+    for name in param_names:
+        low, high = param_defs[name].range
+        batch_parameters[name] = rng.uniform(low, high, size)
+    return CandidateBatch(batch_parameters, size)
+
+def evaluate_candidates(
+        batch:CandidateBatch,
+        bounds_rect:BoundsRect | None = None,
+        offset=(0, 0),
+        check_length:bool = True,
+        check_tips:bool = True,
+        check_collisions:bool = True) -> list[str | None]:
+    """The first constraint each candidate violates, or None if it passes."""
+    num_veins = int(batch.parameters['num_root_segments'])
+    index = np.arange(1, num_veins + 1)
+    size = batch.size
+    constraints = np.full(size, None, dtype=object)
+    remaining = np.ones(size, dtype=bool)
+
+    def reject(failed, constraint):
+        failed = failed & remaining
+        constraints[failed] = constraint
+        remaining[failed] = False
+
+    counts = np.broadcast_to(
+        num_generations(batch.expanded(1), index[None, :]), (size, num_veins))
+    if check_length:
+        reject(np.any(counts < 2, axis=1), LENGTH_CONSTRAINT)
+
+    roots = np.broadcast_to(
+        quadratic_param_to_array(batch.expanded(1), 'root_segment_pos', index),
+        (size, num_veins, 2))
+    if bounds_rect is not None:
+        reject(~_contained(roots, bounds_rect, offset), BOUNDS_CONSTRAINT)
+
+    if not (check_tips and bounds_rect is not None) and not check_collisions:
+        return list(constraints)
+    live = np.nonzero(remaining)[0]
+    if len(live) == 0:
+        return list(constraints)
+
+    positions, vectors, mask = _grow(batch.subset(remaining), roots[live], counts[live])
+
+    if check_tips and bounds_rect is not None:
+        failed = np.zeros(size, dtype=bool)
+        failed[live] = ~_contained(_tips(positions, vectors, counts[live]), bounds_rect, offset)
+        reject(failed, BOUNDS_CONSTRAINT)
+
+    still_live = remaining[live]
+    if check_collisions and np.any(still_live):
+        failed = np.zeros(size, dtype=bool)
+        failed[live[still_live]] = _has_collision(
+            positions[still_live], vectors[still_live], mask[still_live])
+        reject(failed, COLLISION_CONSTRAINT)
+
+    return list(constraints)
+
+def evaluate_constraints(
+        batch:CandidateBatch,
+        bounds_rect:BoundsRect,
+        base_bounds_rect:BoundsRect,
+        offset=(0, 0)) -> dict[str, np.ndarray]:
+    """Every constraint on every candidate, keyed by the `VeinRenderer` method it matches."""
+    num_veins = int(batch.parameters['num_root_segments'])
+    index = np.arange(1, num_veins + 1)
+    size = batch.size
+    counts = np.array(np.broadcast_to(
+        num_generations(batch.expanded(1), index[None, :]), (size, num_veins)))
+    roots = np.broadcast_to(
+        quadratic_param_to_array(batch.expanded(1), 'root_segment_pos', index),
+        (size, num_veins, 2))
+    positions, vectors, mask = _grow(batch, roots, counts)
+    return {
+        "is_base_contained_by": _contained(roots, base_bounds_rect, offset),
+        "is_contained_by": _contained(roots, bounds_rect, offset) &
+            _contained(_tips(positions, vectors, counts), bounds_rect, offset),
+        "has_collision": _has_collision(positions, vectors, mask),
+        "primary_vein_length_constraint": np.all(counts > 1, axis=1),
+    }
+
+def _contained(points:np.ndarray, bounds_rect:BoundsRect, offset) -> np.ndarray:
+    # Strictly inside, matching Polygon.contains.
+    lower = np.subtract(bounds_rect.topleft, offset)
+    upper = np.subtract(bounds_rect.bottomright, offset)
+    return np.all((points > lower) & (points < upper), axis=(-2, -1))
+
+def _tips(positions:np.ndarray, vectors:np.ndarray, counts:np.ndarray) -> np.ndarray:
+    return np.take_along_axis(
+        positions + vectors, (counts - 1)[:, :, None, None], axis=2)[:, :, 0]
+
+def _grow(batch:CandidateBatch, roots:np.ndarray, counts:np.ndarray):
+    """Segment starts, vectors and a mask of the generations each vein reaches."""
+    num_veins = roots.shape[1]
+    index = np.arange(1, num_veins + 1)
+    generation = np.arange(int(counts.max()))
+    parameters = batch.expanded(2)
+
+    directions = segment_directions(parameters, index[None, :, None], generation[None, None, :])
+    lengths = np.array(np.broadcast_to(
+        np.asarray(batch.expanded(1)['segment_len_factor'], dtype=float),
+        (batch.size, len(generation))))
+    lengths[:, 0] = np.broadcast_to(batch.expanded(0)['root_segment_len'], batch.size)
+    np.cumprod(lengths, axis=1, out=lengths)
+    vectors = np.broadcast_to(
+        directions * lengths[:, None, :, None], (batch.size, num_veins, len(generation), 2))
+
+    positions = np.empty_like(vectors)
+    positions[:, :, 0] = roots
+    positions[:, :, 1:] = vectors[:, :, :-1]
+    np.cumsum(positions, axis=2, out=positions)
+
+    mask = generation[None, None, :] < counts[:, :, None]
+    return positions, vectors, mask
+
+def _has_collision(positions:np.ndarray, vectors:np.ndarray, mask:np.ndarray) -> np.ndarray:
+    """Whether each candidate has crossing segments."""
+    size, num_veins, num_generations = mask.shape
+    candidate, vein, generation = np.nonzero(mask)
+    p = positions[mask]
+    s = vectors[mask]
+    endpoints = p + s
+    lower = np.minimum(p, endpoints)
+    upper = np.maximum(p, endpoints)
+
+    # Every wing covers much the same area, so candidates are laid side by
+    # side in the index to keep their boxes from overlapping each other. The
+    # boxes are padded slightly so the shift can't round a touching pair apart.
+    stride = float(np.max(upper[:, 0]) - np.min(lower[:, 0])) + 1.0
+    shift = candidate * stride
+    boxes = shapely.box(
+        lower[:, 0] + shift - BOX_PADDING, lower[:, 1] - BOX_PADDING,
+        upper[:, 0] + shift + BOX_PADDING, upper[:, 1] + BOX_PADDING)
+    first, second = STRtree(boxes).query(boxes)
+
+    keep = (first < second) & (candidate[first] == candidate[second]) & ~is_adjacent(
+        vein[first], generation[first], vein[second], generation[second])
+    first, second = first[keep], second[keep]
+    hit, _ = segment_intersections(p[first], s[first], p[second], s[second])
+
+    result = np.zeros(size, dtype=bool)
+    result[candidate[first[hit]]] = True
+    return result
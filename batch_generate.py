@@ -0,0 +1,187 @@
+#!./venv/bin/python3
+
+"""Generate wings in bulk without opening a window.
+
+Each wing runs the same randomize, validate, cross vein and render steps as
+the interactive keys, and is written to the output directory as a PNG with a
+JSON file of its parameters.
+
+    ./batch_generate.py --count 100 --parameters parameters.json --randomize primary generation
+
+With --cache, vein geometry and relaxed cells are kept on disk, so running a
+seeded batch again reads them back instead of recomputing them. With --graph,
+each wing's venation graph is also written as a compressed .npz file.
+"""
+
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import multiprocessing
+import os
+import random
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from shapely.errors import GEOSException
+
+from get_param_defs import get_param_defs
+from param_set import ParamSet
+from param_set_defaults import default_param_set
+import randomizer
+from tiled_exporter import TiledExporter
+from vein_renderer import VeinRenderer
+from venation_graph import VenationGraph
+from wing_cache import WingCache
+from wing_bounds import RENDER_OFFSET, SCREEN_HEIGHT, SCREEN_WIDTH
+
+RANDOMIZERS = {
+    "base": randomizer.randomize_base_parameters,
+    "primary": randomizer.randomize_primary_vein_parameters,
+    "generation": randomizer.randomize_generation_parameters,
+}
+
+MAX_ATTEMPTS_REACHED = "Max attempts reached."
+
+# One per worker process, sharing the same directory.
+_wing_cache: WingCache | None = None
+
+def get_wing_cache(directory:str) -> WingCache:
+    global _wing_cache
+    if _wing_cache is None:
+        _wing_cache = WingCache(directory=directory)
+    return _wing_cache
+
+def write_wing_image(vein_renderer:VeinRenderer, filename:str, scale:float):
+    if scale == 1:
+        pygame.image.save(render_wing(vein_renderer), filename)
+    else:
+        TiledExporter(vein_renderer, (SCREEN_WIDTH, SCREEN_HEIGHT), RENDER_OFFSET, scale) \
+            .write_png(filename)
+
+def render_wing(vein_renderer:VeinRenderer) -> pygame.Surface:
+    result = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    result.fill((0, 0, 0))
+    result.blit(vein_renderer.get_surface(result.get_size(), RENDER_OFFSET))
+    return result
+
+def generate_wing(
+        index:int,
+        parameters:ParamSet,
+        stages:list[str],
+        prefix:str,
+        seed:int | None,
+        cache_dir:str | None = None,
+        scale:float = 1,
+        write_graph:bool = False) -> tuple[int, str | None, Counter, Counter]:
+    """Generate, check and write one wing. Returns its index, the image filename
+    or None if it was rejected, a count of every rejection along the way and
+    the wing's cache hits and misses."""
+    if seed is not None:
+        random.seed(seed + index)
+
+    rejections:Counter = Counter()
+    cache_counts:Counter = Counter()
+    parameters = ParamSet(**parameters)
+    param_defs = get_param_defs()
+    for stage in stages:
+        if not RANDOMIZERS[stage](parameters, param_defs, rejections, verbose=False):
+            rejections[MAX_ATTEMPTS_REACHED] += 1
+            return index, None, rejections, cache_counts
+    parameters["cross_vein_seed"] = random.getrandbits(32)
+
+    try:
+        failure = randomizer.check_wing(parameters)
+        if failure is not None:
+            rejections[randomizer.REJECTIONS[failure.constraint]] += 1
+            return index, None, rejections, cache_counts
+        cache = get_wing_cache(cache_dir) if cache_dir is not None else None
+        before = cache.stats() if cache is not None else None
+        vein_renderer = VeinRenderer(parameters, cache)
+        vein_renderer.generate_cross_veins()
+        if cache is not None and before is not None:
+            after = cache.stats()
+            cache_counts["hits"] = after.hits - before.hits
+            cache_counts["misses"] = after.misses - before.misses
+    except GEOSException:
+        rejections[randomizer.REJECTED_GEOS_EXCEPTION] += 1
+        return index, None, rejections, cache_counts
+
+    filename = f"{prefix}{str(index).zfill(5)}"
+    write_wing_image(vein_renderer, f"{filename}.png", scale)
+    with open(f"{filename}.json", 'w', encoding='utf-8') as f:
+        json.dump(parameters, f, indent=2)
+    if write_graph:
+        VenationGraph.from_vein_renderer(vein_renderer).save(f"{filename}.npz")
+    return index, f"{filename}.png", rejections, cache_counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=10, help="number of wings to attempt")
+    parser.add_argument(
+        "--parameters",
+        help="JSON parameter file to start from (defaults to the built-in defaults)")
+    parser.add_argument(
+        "--randomize", nargs="*", choices=list(RANDOMIZERS), default=list(RANDOMIZERS),
+        help="parameter groups to randomize for each wing, in order")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, help="base random seed for reproducible batches")
+    parser.add_argument("--prefix", default="output/batch_", help="output filename prefix")
+    parser.add_argument("--cache", help="directory to keep generated geometry in between runs")
+    parser.add_argument(
+        "--scale", type=float, default=1,
+        help="image size as a multiple of the screen, rendered in tiles when not 1")
+    parser.add_argument(
+        "--graph", action="store_true", help="also write each wing's venation graph")
+    args = parser.parse_args()
+
+    parameters = default_param_set()
+    if args.parameters:
+        with open(args.parameters, 'r', encoding='utf-8') as f:
+            parameters.update(json.load(f))
+    os.makedirs(os.path.dirname(args.prefix) or ".", exist_ok=True)
+
+    jobs = [
+        (i, parameters, args.randomize, args.prefix, args.seed, args.cache, args.scale,
+         args.graph)
+        for i in range(args.count)]
+    rejections:Counter = Counter()
+    cache_counts:Counter = Counter()
+    num_written = 0
+
+    executor = None
+    start = time.perf_counter()
+    if args.workers <= 1:
+        results = (generate_wing(*job) for job in jobs)
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context('spawn'))
+        results = (future.result() for future in as_completed(
+            [executor.submit(generate_wing, *job) for job in jobs]))
+
+    for index, filename, wing_rejections, wing_cache_counts in results:
+        rejections.update(wing_rejections)
+        cache_counts.update(wing_cache_counts)
+        if filename is None:
+            print(f"Wing {index} rejected.")
+        else:
+            num_written += 1
+            print(f"Wrote {filename}")
+    elapsed = time.perf_counter() - start
+
+    if executor is not None:
+        executor.shutdown()
+
+    print(f"Wrote {num_written} of {args.count} wings in {elapsed:.1f}s "
+          f"({num_written / elapsed:.2f} wings/sec)")
+    print("Rejections:")
+    for reason, count in rejections.most_common():
+        print(f"  {count:>8}  {reason}")
+    if args.cache:
+        print(f"Cache: {cache_counts['hits']} hits, {cache_counts['misses']} misses")
+
+if __name__ == "__main__":
+    main()
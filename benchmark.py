@@ -0,0 +1,269 @@
+#!./venv/bin/python3
+
+"""Time each stage of the wing pipeline on a fixed set of wings.
+
+Every stage runs headless on the same corpus each time: the shipped
+parameters.json, the built-in defaults and stress cases with the vein count,
+generation count and cross vein density at the top of their ranges. Results
+are written as JSON so runs can be compared.
+
+Startup is measured too: the import time and peak memory of a fresh process
+loading the geometry core, the pygame rendering layer on top of it, the UI on
+top of that, and main_orthoptera as its worker processes import it.
+
+    ./benchmark.py --repeat 5 --output benchmark.json
+    ./benchmark.py --compare benchmark.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+import shapely
+
+from get_param_defs import get_param_defs
+from interveinal_region_renderer import InterveinalRegionRenderer
+from param_set import ParamSet
+from param_set_defaults import default_param_set
+from screen_capturer import ScreenCapturer
+from vein_renderer import VeinRenderer
+from vein_tree import VeinTree
+from wing_bounds import RENDER_OFFSET, SCREEN_HEIGHT, SCREEN_WIDTH, TARGET_BOX
+
+BENCHMARK_VERSION = 1
+SEED = 0
+
+# Modules loaded by each layer, each including the ones before it.
+CORE_MODULES = ["vein_renderer", "batch_evaluator", "randomizer", "venation_graph"]
+RENDERING_MODULES = CORE_MODULES + ["tiled_exporter", "screen_capturer"]
+UI_MODULES = RENDERING_MODULES + ["pygame_gui", "slider_panel"]
+STARTUP_LAYERS = {
+    "python": [],
+    "core": CORE_MODULES,
+    "rendering": RENDERING_MODULES,
+    "ui": UI_MODULES,
+    "worker": ["main_orthoptera"],
+}
+
+# Run in a fresh interpreter. Prints the import time in seconds and the peak
+# resident set size in bytes. On Linux, ru_maxrss carries over the peak of the
+# process that forked it, so the kernel's own figure for this one is used.
+STARTUP_SCRIPT = """
+import importlib, resource, sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+elapsed = time.perf_counter() - start
+try:
+    with open("/proc/self/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:"))
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, rss)
+"""
+
+def get_corpus() -> dict[str, ParamSet]:
+    param_defs = get_param_defs()
+
+    def top_of_range(parameters:ParamSet, names:list[str]) -> ParamSet:
+        result = ParamSet(**parameters)
+        for name in names:
+            result[name] = param_defs[name].range[1] # type: ignore[literal-required]
+        return result
+
+    defaults = default_param_set()
+    shipped = ParamSet(**defaults)
+    with open('parameters.json', 'r', encoding='utf-8') as f:
+        shipped.update(json.load(f))
+    return {
+        "parameters.json": shipped,
+        "defaults": defaults,
+        "max_veins": top_of_range(defaults, ["num_root_segments", "max_generations_const"]),
+        "max_density": top_of_range(shipped, ["cross_vein_density"]),
+        "max_all": top_of_range(
+            shipped, ["num_root_segments", "max_generations_const", "cross_vein_density"]),
+    }
+
+def time_call(fn, repeat:int) -> dict[str, float]:
+    """Seconds per call over `repeat` runs, each seeded the same way."""
+    samples = []
+    for _ in range(repeat):
+        random.seed(SEED)
+        np.random.seed(SEED)
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def summarize(samples:list[float]) -> dict[str, float]:
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+        "runs": len(samples),
+    }
+
+def benchmark_regions(vein_renderer:VeinRenderer, parameters:ParamSet, repeat:int) -> dict:
+    """Time building every interveinal region of one wing half, in total and
+    split into the stages each region records while it's built."""
+    vein_points = vein_renderer.vein_polylines()
+    pairs = list(zip(vein_points[:-1], vein_points[1:]))
+
+    samples:list[float] = []
+    stages:dict[str, list[float]] = {"seeding": [], "lloyd": [], "voronoi_clipping": []}
+    lloyd_iterations = 0
+    for _ in range(repeat):
+        random.seed(SEED)
+        np.random.seed(SEED)
+        totals = dict.fromkeys(stages, 0.0)
+        lloyd_iterations = 0
+        start = time.perf_counter()
+        for i, (points0, points1) in enumerate(pairs):
+            region = InterveinalRegionRenderer(points0, points1, parameters, "right", i)
+            for name, _, duration, _ in region.stage_timings:
+                totals[name] += duration
+            lloyd_iterations += region.lloyd_iterations
+        samples.append(time.perf_counter() - start)
+        for name, total in totals.items():
+            stages[name].append(total)
+
+    result = {"interveinal_regions": summarize(samples)}
+    for name, stage_samples in stages.items():
+        result[f"interveinal_regions.{name}"] = summarize(stage_samples)
+    result["interveinal_regions"]["regions"] = len(pairs)
+    result["interveinal_regions"]["lloyd_iterations"] = lloyd_iterations
+    return result
+
+def benchmark_wing(parameters:ParamSet, repeat:int, capture_dir:str) -> dict:
+    random.seed(SEED)
+    np.random.seed(SEED)
+    vein_renderer = VeinRenderer(parameters)
+    results = {
+        "generate_segments": time_call(lambda: VeinTree.from_parameters(parameters), repeat),
+        "has_collision": time_call(vein_renderer.has_collision, repeat),
+        "is_contained_by": time_call(
+            lambda: vein_renderer.is_contained_by(TARGET_BOX, RENDER_OFFSET), repeat),
+    }
+    results["generate_segments"]["segments"] = len(vein_renderer.vein_tree.positions)
+    results.update(benchmark_regions(vein_renderer, parameters, repeat))
+
+    random.seed(SEED)
+    np.random.seed(SEED)
+    vein_renderer.generate_cross_veins()
+    surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+    results["render_to"] = time_call(
+        lambda: vein_renderer.render_to(surface, RENDER_OFFSET), repeat)
+
+    capturer = ScreenCapturer(os.path.join(capture_dir, "capture_"), ".png")
+    # What the render thread waits for, then the whole write.
+    results["screen_capture.enqueue"] = time_call(lambda: capturer.capture(surface), repeat)
+    capturer.flush()
+
+    def capture_and_write():
+        capturer.capture(surface)
+        capturer.flush()
+
+    results["screen_capture"] = time_call(capture_and_write, repeat)
+    return results
+
+def benchmark_startup(repeat:int) -> dict:
+    """Import time and peak memory of a new process for each layer, which is
+    what every spawned worker pays before it does any work."""
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+    results = {}
+    for layer, modules in STARTUP_LAYERS.items():
+        samples = []
+        rss = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT, *modules],
+                capture_output=True, text=True, check=True, env=env).stdout.split()
+            samples.append(float(output[-2]))
+            rss.append(int(output[-1]))
+        results[f"import.{layer}"] = summarize(samples)
+        results[f"import.{layer}"]["rss_mb"] = round(max(rss) / 2**20, 1)
+    return results
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "shapely": shapely.__version__,
+        "pygame": pygame.version.ver,
+    }
+
+def print_comparison(baseline:dict, report:dict):
+    """Median time of every stage against the same stage in `baseline`."""
+    print(f"Compared with {baseline['environment'].get('commit')}:", file=sys.stderr)
+    for name, stages in report["results"].items():
+        for stage, timing in stages.items():
+            previous = baseline["results"].get(name, {}).get(stage)
+            if previous is None or previous["median"] == 0:
+                continue
+            ratio = timing["median"] / previous["median"]
+            print(f"  {name:<16} {stage:<36} {ratio:>6.2f}x", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each stage")
+    parser.add_argument(
+        "--wings", nargs="*",
+        help="names of the corpus wings to run (defaults to all of them)")
+    parser.add_argument("--output", help="JSON file to write (defaults to stdout)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    pygame.init()
+    corpus = get_corpus()
+    names = args.wings or list(corpus)
+
+    print("Benchmarking startup...", file=sys.stderr)
+    results = {"startup": benchmark_startup(args.repeat)}
+    for stage, timing in results["startup"].items():
+        print(f"  {stage:<36} {timing['median'] * 1000:>10.2f} ms {timing['rss_mb']:>8.1f} MB",
+              file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as capture_dir:
+        for name in names:
+            print(f"Benchmarking {name}...", file=sys.stderr)
+            results[name] = benchmark_wing(corpus[name], args.repeat, capture_dir)
+            for stage, timing in results[name].items():
+                print(f"  {stage:<36} {timing['median'] * 1000:>10.2f} ms", file=sys.stderr)
+    pygame.quit()
+
+    report = {"environment": get_environment(), "repeat": args.repeat, "results": results}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
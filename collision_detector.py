@@ -0,0 +1,81 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from vein_tree import VeinTree
+
+def segment_intersections(p0:np.ndarray, s0:np.ndarray, p1:np.ndarray, s1:np.ndarray):
+    """Batched segment-segment intersection.
+
+    Segments are given as start points `p` and displacement vectors `s`, each
+    of shape (..., 2). Returns a boolean mask of proper crossings (touching
+    endpoints and parallel segments don't count) and the crossing points
+    measured along the first segment."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denominator = -s1[..., 0] * s0[..., 1] + s0[..., 0] * s1[..., 1]
+        dx = p0[..., 0] - p1[..., 0]
+        dy = p0[..., 1] - p1[..., 1]
+        s = (-s0[..., 1] * dx + s0[..., 0] * dy) / denominator
+        t = ( s1[..., 0] * dy - s1[..., 1] * dx) / denominator
+        hit = (denominator != 0) & (s > 0) & (s < 1) & (t > 0) & (t < 1)
+    return hit, p0 + t[..., None] * s0
+
+def is_adjacent(index0, generation0, index1, generation1):
+    """Neighbouring segments of the same vein always touch so aren't collisions."""
+    return (index0 == index1) & (np.abs(generation0 - generation1) < 2)
+
+class CollisionDetector:
+    """Finds crossings between primary vein segments.
+
+    Segments are bucketed in an STR-tree so only pairs with overlapping bounds
+    reach the exact intersection test. Segments are ranked breadth-first, by
+    generation and then by vein, and the reported hit is the one a
+    breadth-first walk of the veins would find first."""
+
+    def __init__(self, tree:VeinTree):
+        self._positions = tree.positions
+        self._vectors = tree.directions * tree.lengths[:, None]
+        self._indices = tree.indices
+        self._generations = tree.generations
+
+        order = np.lexsort((tree.indices, tree.generations))
+        self._rank = np.empty(len(order), dtype=int)
+        self._rank[order] = np.arange(len(order))
+
+        endpoints = self._positions + self._vectors
+        self._boxes = shapely.box(
+            np.minimum(self._positions[:, 0], endpoints[:, 0]),
+            np.minimum(self._positions[:, 1], endpoints[:, 1]),
+            np.maximum(self._positions[:, 0], endpoints[:, 0]),
+            np.maximum(self._positions[:, 1], endpoints[:, 1]))
+        self._strtree = STRtree(self._boxes)
+
+    def first_collision(self) -> np.ndarray | None:
+        later, earlier = self._candidate_pairs()
+        if len(later) == 0:
+            return None
+
+        hit, points = segment_intersections(
+            self._positions[later], self._vectors[later],
+            self._positions[earlier], self._vectors[earlier])
+        if not np.any(hit):
+            return None
+
+        rank_later = self._rank[later][hit]
+        rank_earlier = self._rank[earlier][hit]
+        first = np.lexsort((rank_earlier, rank_later))[0]
+        return points[hit][first]
+
+    def _candidate_pairs(self):
+        # Bounding box overlaps only; the exact test happens in the kernel.
+        first, second = self._strtree.query(self._boxes)
+
+        # Each unordered pair is tested once, from the later segment in
+        # breadth-first order against the earlier one.
+        keep = self._rank[first] > self._rank[second]
+        first, second = first[keep], second[keep]
+
+        keep = ~is_adjacent(
+            self._indices[first], self._generations[first],
+            self._indices[second], self._generations[second])
+        return first[keep], second[keep]
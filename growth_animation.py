@@ -0,0 +1,126 @@
+from collections import deque
+import time
+from typing import Iterator
+
+import numpy as np
+import pygame
+from shapely.geometry import Polygon
+
+from polygon_edges import merged_edges
+from stage_timer import get_stage_timer
+from vein_renderer import VeinRenderer
+
+VEIN_WIDTH = 3
+CROSS_VEIN_WIDTH = 1
+TRANSPARENT = (0, 0, 0, 0)
+
+# Frames spent growing each generation of segments.
+FRAMES_PER_GENERATION = 4
+# Seconds of each frame given to relaxing cells.
+RELAXATION_FRAME_BUDGET = 0.004
+
+class GrowthAnimation:
+    """Plays a wing back as it grows, drawing only what changed each frame."""
+
+    def __init__(self, vein_renderer:VeinRenderer, size, offset):
+        self._vein_renderer = vein_renderer
+        self._offset = np.asarray(offset, dtype=float)
+        self._surface = pygame.Surface(size, pygame.SRCALPHA)
+        if pygame.display.get_surface() is not None:
+            self._surface = self._surface.convert_alpha()
+        self._surface.fill(TRANSPARENT)
+        self._vein_color = pygame.Color(255, 255, 255, vein_renderer.parameters["alpha"])
+        self._cross_vein_color = pygame.Color(255, 255, 255)
+
+        # A vein's points run in generation order, so the segment from point
+        # g to point g + 1 is the one grown in generation g.
+        veins = vein_renderer.vein_polylines()
+        self._veins = [self._to_screen(points, h_flip) for h_flip in (-1, 1) for points in veins]
+        self._vein_lines = [points.tolist() for points in self._veins]
+        self._num_generations = max((len(points) - 1 for points in veins), default=0)
+        self._frame = 0
+
+        left, right = vein_renderer.interveinal_regions
+        self._regions = deque(
+            _RelaxingRegion(region.relaxation_steps(), h_flip, i)
+            for h_flip, regions in ((-1, left), (1, right)) for i, region in enumerate(regions))
+        self._finished = False
+
+    @property
+    def done(self) -> bool:
+        return self._finished
+
+    def advance(self) -> pygame.Surface:
+        """Draw the next frame's changes and return the surface."""
+        if self._frame < self._num_generations * FRAMES_PER_GENERATION:
+            generation, step = divmod(self._frame, FRAMES_PER_GENERATION)
+            with get_stage_timer().stage("growth", generation=generation):
+                self._grow(generation, step)
+                self._frame += 1
+                if self._frame == self._num_generations * FRAMES_PER_GENERATION:
+                    self._redraw_veins()
+        elif self._regions:
+            with get_stage_timer().stage("relaxation", regions=len(self._regions)):
+                self._relax()
+        else:
+            # Erasing cells can take stray pixels from their neighbours, so
+            # the last frame is drawn whole, the same as the still wing.
+            self._surface.fill(TRANSPARENT)
+            self._vein_renderer.render_to(self._surface, tuple(self._offset))
+            self._finished = True
+        return self._surface
+
+    def _grow(self, generation:int, step:int):
+        """Draw the next fraction of every segment of `generation`."""
+        start = step / FRAMES_PER_GENERATION
+        end = (step + 1) / FRAMES_PER_GENERATION
+        for points in self._veins:
+            if len(points) > generation + 1:
+                a, b = points[generation], points[generation + 1]
+                pygame.draw.line(
+                    self._surface, self._vein_color,
+                    a + (b - a) * start, a + (b - a) * end, VEIN_WIDTH)
+
+    def _redraw_veins(self):
+        """Draw the grown veins again, each as one polyline."""
+        self._surface.fill(TRANSPARENT)
+        for points in self._vein_lines:
+            pygame.draw.lines(self._surface, self._vein_color, False, points, VEIN_WIDTH)
+
+    def _relax(self):
+        """Relax regions in turn until the frame's budget is spent."""
+        deadline = time.perf_counter() + RELAXATION_FRAME_BUDGET
+        for i in range(len(self._regions)):
+            # A region's last iteration is the best guess at its next one.
+            start = time.perf_counter()
+            if i > 0 and start + self._regions[0].step_time > deadline:
+                break
+            region = self._regions.popleft()
+            cells = next(region.steps, None)
+            if cells is None:
+                continue
+            self._regions.append(region)
+            # Overdrawn with the same points, the old lines clear the same pixels.
+            for points in region.lines:
+                pygame.draw.lines(self._surface, TRANSPARENT, False, points, CROSS_VEIN_WIDTH)
+            region.lines = [
+                self._to_screen(points, region.h_flip).tolist() for points in merged_edges(cells)]
+            for points in region.lines:
+                pygame.draw.lines(
+                    self._surface, self._cross_vein_color, False, points, CROSS_VEIN_WIDTH)
+            # The region's cells run up to its veins, which are drawn over them.
+            first_vein = region.number + (0 if region.h_flip < 0 else len(self._veins) // 2)
+            for points in self._vein_lines[first_vein:first_vein + 2]:
+                pygame.draw.lines(self._surface, self._vein_color, False, points, VEIN_WIDTH)
+            region.step_time = time.perf_counter() - start
+
+    def _to_screen(self, points:np.ndarray, h_flip:int) -> np.ndarray:
+        return self._offset + points * (h_flip, 1)
+
+class _RelaxingRegion:
+    def __init__(self, steps:Iterator[list[Polygon]], h_flip:int, number:int):
+        self.steps = steps
+        self.h_flip = h_flip
+        self.number = number
+        self.lines: list[list] = []
+        self.step_time = 0.0
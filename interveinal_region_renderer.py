@@ -1,99 +1,201 @@
 from math import floor
-import random
+import os
+import time
+from typing import Iterator
 
 import numpy as np
-import pygame
 from shapely.errors import GEOSException
-from shapely.geometry import LineString, MultiPoint, Point, Polygon
-from shapely import intersection, normalize, voronoi_polygons
+from shapely.geometry import LineString, MultiPoint, Polygon
+from shapely import centroid, contains_xy, get_coordinates, get_exterior_ring, \
+    get_num_coordinates, get_parts, get_x, get_y, intersection, line_interpolate_point, \
+    linearrings, multipoints, normalize, polygons, voronoi_polygons
 
 from param_set import ParamSet
-from segment import Segment
+
+LLOYD_MAX_ITERATIONS = 50
+# Relaxation stops once no center moves further than this. A cell edge lies on
+# the bisector between two centers so it moves at most half as far, which is
+# below what's visible when drawn at whole pixels.
+LLOYD_TOLERANCE = 1.0
+
+SIDES = ("left", "right")
+
+def region_rng(seed:int, side:str, region_number:int) -> np.random.Generator:
+    """The random stream for one region of a wing. Every region's stream is
+    independent of the others, so a region comes out the same whichever
+    process builds it and whatever else is built alongside."""
+    return np.random.default_rng([seed, SIDES.index(side), region_number])
 
 class InterveinalRegionRenderer:
-    def __init__(self, root_segment0, root_segment1, parameters:ParamSet):
+    def __init__(
+            self,
+            vein_points0:np.ndarray,
+            vein_points1:np.ndarray,
+            parameters:ParamSet,
+            side:str,
+            region_number:int,
+            initial_centers:np.ndarray | None = None):
+        """The region between two neighbouring primary veins, each given as the
+        polyline through its segment start points and its tip endpoint. The
+        cells are the same for the same veins, parameters, side and region
+        number, with the randomness seeded by the `cross_vein_seed` parameter.
+
+        Relaxation can be warm started from `initial_centers`, the centers of
+        this region in a similar wing, so the cells only move as far as the
+        wing changed. The cells then also depend on those centers."""
         self._parameters = parameters
-        self._root_segment0 = root_segment0
-        self._root_segment1 = root_segment1
-        self._polygon = self._get_polygon(root_segment0, root_segment1)
-        inhibitory_centers = self._get_inhibitory_centers(self._polygon)
-        self._inhibitory_centers = self._lloyds_algorithm(inhibitory_centers, 50)
+        self._vein_points0 = vein_points0
+        self._vein_points1 = vein_points1
+        self._side = side
+        self._region_number = region_number
+        self._polygon = self._get_polygon(vein_points0, vein_points1)
+        # Regions are often built in worker processes, so stage times are
+        # kept with the region for the parent to record.
+        self._stage_timings: list[tuple[str, float, float, dict]] = []
+        pid = os.getpid()
+
+        start = time.perf_counter()
+        rng = region_rng(int(parameters["cross_vein_seed"]), side, region_number)
+        inhibitory_centers = self._get_inhibitory_centers(self._polygon, rng)
+        if initial_centers is not None:
+            inhibitory_centers = self._warm_start_centers(initial_centers, inhibitory_centers)
+        end = time.perf_counter()
+        self._stage_timings.append(
+            ("seeding", start, end - start, {"centers": len(inhibitory_centers.geoms), "pid": pid}))
+
+        self._lloyd_iterations = 0
+        self._lloyd_displacement = float('inf')
+        start = end
+        self._inhibitory_centers = self._lloyds_algorithm(
+            inhibitory_centers, LLOYD_MAX_ITERATIONS, LLOYD_TOLERANCE)
+        end = time.perf_counter()
+        self._stage_timings.append(
+            ("lloyd", start, end - start, {"iterations": self._lloyd_iterations, "pid": pid}))
+
+        start = end
         self._voronoi_polygons = self._get_voronoi_polygons(self._inhibitory_centers, self._polygon)
-
-    def render_to(self, surf, offset, h_flip):
-        self._render_voronoi_polygons(surf, offset, h_flip)
-
-    def _render_inhibitory_centers(self, surf, offset, h_flip):
-        color = pygame.Color(255, 255, 255)
-        for point in self._inhibitory_centers.geoms:
-            point = (point.x, point.y)
-            pos = tuple(np.add(offset, np.multiply([h_flip, 1], point)))
-            pygame.draw.circle(surf, color, pos, 3)
-
-    def _render_voronoi_polygons(self, surf, offset, h_flip):
-        color = pygame.Color(255, 255, 255)
-        for polygon in self._voronoi_polygons:
-            points = tuple(polygon.exterior.coords)
-            points = [tuple(np.add(offset, np.multiply([h_flip, 1], point))) for point in points]
-            prev_point = False
-            for point in points:
-                if prev_point:
-                    pygame.draw.line(surf, color, prev_point, point)
-                prev_point = point
-
-    def _get_polygon(self, seg0, seg1):
-        # Get a list of points traveling down seg0 and up seg1.
-        points = []
-        points.extend(self._get_segment_points(seg0))
-        points.extend(reversed(self._get_segment_points(seg1)))
-        return Polygon(points)
-
-    def _get_segment_points(self, segment:Segment):
-        result = []
-        while True:
-            result.append((segment.position.x, segment.position.y))
-            if len(segment.children) > 0:
-                segment = segment.children[0]
-            else:
-                break
-        endpoint = self._get_endpoint(segment)
-        result.append((endpoint.x, endpoint.y))
+        end = time.perf_counter()
+        self._stage_timings.append(
+            ("voronoi_clipping", start, end - start, {"cells": len(self._voronoi_polygons), "pid": pid}))
+
+    @classmethod
+    def from_arrays(
+            cls,
+            vein_points0:np.ndarray,
+            vein_points1:np.ndarray,
+            parameters:ParamSet,
+            side:str,
+            region_number:int,
+            arrays:dict[str, np.ndarray]) -> 'InterveinalRegionRenderer':
+        """A region relaxed earlier, rebuilt from `to_arrays` output."""
+        result = cls.__new__(cls)
+        result._parameters = parameters
+        result._vein_points0 = vein_points0
+        result._vein_points1 = vein_points1
+        result._side = side
+        result._region_number = region_number
+        result._polygon = result._get_polygon(vein_points0, vein_points1)
+        centers = arrays['centers']
+        result._inhibitory_centers = multipoints(centers) if len(centers) > 0 else MultiPoint([])
+        rings = linearrings(arrays['cell_coords'], indices=np.repeat(
+            np.arange(len(arrays['cell_offsets']) - 1), np.diff(arrays['cell_offsets'])))
+        result._voronoi_polygons = list(polygons(rings)) if len(arrays['cell_coords']) > 0 else []
+        result._lloyd_iterations = int(arrays['lloyd_iterations'])
+        result._lloyd_displacement = float(arrays['lloyd_displacement'])
+        result._stage_timings = []
         return result
 
-    # TODO: De-duplicate with vein_renderer.py
-    def _get_endpoint(self, segment:Segment):
-        return segment.position + segment.direction * segment.length
-
-    def _get_inhibitory_centers(self, interveinal_region):
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """The relaxed centers and the outline of every cell, for caching."""
+        rings = get_exterior_ring(np.asarray(self._voronoi_polygons, dtype=object))
+        rings = rings[get_num_coordinates(rings) > 0]
+        cell_offsets = np.zeros(len(rings) + 1, dtype=int)
+        np.cumsum(get_num_coordinates(rings), out=cell_offsets[1:])
+        return {
+            'centers': get_coordinates(self._inhibitory_centers),
+            'cell_coords': get_coordinates(rings),
+            'cell_offsets': cell_offsets,
+            'lloyd_iterations': np.array(self._lloyd_iterations),
+            'lloyd_displacement': np.array(self._lloyd_displacement),
+        }
+
+    @property
+    def centers(self) -> np.ndarray:
+        """The relaxed centers as an (n, 2) array."""
+        return get_coordinates(self._inhibitory_centers)
+
+    @property
+    def voronoi_polygons(self) -> list[Polygon]:
+        """The relaxed cells, clipped to the region."""
+        return list(self._voronoi_polygons)
+
+    def relaxation_steps(self) -> Iterator[list[Polygon]]:
+        """The cells as they were before each Lloyd iteration, then the relaxed
+        cells, replayed from the seeded centers so the steps end where this
+        region did."""
+        rng = region_rng(int(self._parameters["cross_vein_seed"]), self._side, self._region_number)
+        centers = get_coordinates(self._get_inhibitory_centers(self._polygon, rng))
+        for cells, _, _ in self._lloyd_steps(centers, LLOYD_MAX_ITERATIONS, LLOYD_TOLERANCE):
+            yield list(cells)
+        yield self.voronoi_polygons
+
+    @property
+    def stage_timings(self) -> list[tuple[str, float, float, dict]]:
+        """Name, `time.perf_counter` start, duration and counts of each stage
+        run to build this region."""
+        return self._stage_timings
+
+    @property
+    def lloyd_iterations(self) -> int:
+        return self._lloyd_iterations
+
+    @property
+    def lloyd_displacement(self) -> float:
+        """Largest distance a center moved in the final Lloyd iteration."""
+        return self._lloyd_displacement
+
+    def _get_polygon(self, vein_points0:np.ndarray, vein_points1:np.ndarray):
+        # Travel down the first vein and back up the second.
+        return Polygon(np.concatenate([vein_points0, vein_points1[::-1]]))
+
+    def _get_inhibitory_centers(self, interveinal_region, rng:np.random.Generator):
         area = interveinal_region.area
 
-        line_string0 = self._segment_to_line_string(self._root_segment0)
-        line_string1 = self._segment_to_line_string(self._root_segment1)
-
-        len0 = line_string0.length
-        len1 = line_string1.length
+        # Seeds are spread along the segment start points, leaving out the tips.
+        line_string0 = LineString(self._vein_points0[:-1])
+        line_string1 = LineString(self._vein_points1[:-1])
 
         density = self._parameters["cross_vein_density"]
-        num_points = floor(area * density * random.uniform(0.90, 1.10))
-        multi_point = MultiPoint([])
+        num_points = floor(area * density * rng.uniform(0.90, 1.10))
+        if num_points <= 0:
+            return MultiPoint([])
 
         # Omit both endpoints to avoid colliding with the edges of the wing.
-        for i in [(x + 1) / (num_points + 1) for x in range(0, num_points)]:
-            p0 = line_string0.interpolate(i * len0)
-            p1 = line_string1.interpolate(i * len1)
-            midpoint = Point(
-              (p0.x + p1.x)/2 + random.uniform(-2, 2),
-              (p0.y + p1.y)/2 + random.uniform(-2, 2))
-            multi_point = MultiPoint(list(multi_point.geoms) + [midpoint])
-        return multi_point
-
-    def _segment_to_line_string(self, segment0:Segment):
-        points = []
-        segment : Segment | None = segment0
-        while segment is not None:
-            points.append(segment.position)
-            segment = segment.children and segment.children[0] or None
-        return LineString(points)
+        fractions = np.arange(1, num_points + 1) / (num_points + 1)
+        p0 = get_coordinates(line_interpolate_point(line_string0, fractions, normalized=True))
+        p1 = get_coordinates(line_interpolate_point(line_string1, fractions, normalized=True))
+        midpoints = (p0 + p1) / 2 + rng.uniform(-2, 2, size=(num_points, 2))
+        return multipoints(midpoints)
+
+    def _warm_start_centers(self, previous:np.ndarray, seeded:MultiPoint) -> MultiPoint:
+        """The previous centers that still fall inside the region, with as many
+        as the seeding chose for it. Extra centers are taken from the closest
+        pairs, and missing ones are the seeds furthest from any center."""
+        seeded = get_coordinates(seeded)
+        centers = previous[contains_xy(self._polygon, previous[:, 0], previous[:, 1])]
+        if len(seeded) == 0:
+            return MultiPoint([])
+        while len(centers) > len(seeded):
+            distances = np.linalg.norm(centers[:, None] - centers[None, :], axis=-1)
+            np.fill_diagonal(distances, np.inf)
+            centers = np.delete(centers, np.argmin(distances.min(axis=1)), axis=0)
+        while len(centers) < len(seeded):
+            if len(centers) == 0:
+                centers = seeded[:1]
+                continue
+            distances = np.linalg.norm(seeded[:, None] - centers[None, :], axis=-1)
+            centers = np.concatenate([centers, seeded[[np.argmax(distances.min(axis=1))]]])
+        return multipoints(centers)
 
     def _get_voronoi_polygons(self, inhibitory_centers, extent):
         try:
@@ -102,12 +204,47 @@ class InterveinalRegionRenderer:
         except GEOSException:
             return []
 
-    def _lloyds_algorithm(self, initial_inhibitory_centers:MultiPoint, iterations:int):
-        inhibitory_centers = initial_inhibitory_centers
-        for _ in range(iterations):
-            temp_voronoi_polygons = self._get_voronoi_polygons(inhibitory_centers, self._polygon)
-            centroids = []
-            for polygon in temp_voronoi_polygons:
-                centroids.append(polygon.centroid)
-            inhibitory_centers = MultiPoint(centroids)
-        return inhibitory_centers
+    def _get_voronoi_cells(self, centers:np.ndarray, extent) -> np.ndarray:
+        # Ordered so cell i belongs to centers[i], which lets centroids be
+        # compared with the centers they replace.
+        cells = voronoi_polygons(multipoints(centers), extend_to=extent, ordered=True)
+        return intersection(get_parts(cells), extent)
+
+    def _lloyds_algorithm(
+            self,
+            initial_inhibitory_centers:MultiPoint,
+            max_iterations:int,
+            tolerance:float = 0.0):
+        centers = get_coordinates(initial_inhibitory_centers)
+        self._lloyd_iterations = 0
+        self._lloyd_displacement = float('inf')
+        for _, centers, displacement in self._lloyd_steps(centers, max_iterations, tolerance):
+            self._lloyd_displacement = displacement
+            self._lloyd_iterations += 1
+        return multipoints(centers) if len(centers) > 0 else MultiPoint([])
+
+    def _lloyd_steps(
+            self,
+            centers:np.ndarray,
+            max_iterations:int,
+            tolerance:float) -> Iterator[tuple[np.ndarray, np.ndarray, float]]:
+        """Run Lloyd iterations one at a time, yielding the cells of the
+        centers going in, the centers coming out and how far they moved."""
+        for _ in range(max_iterations):
+            if len(centers) == 0:
+                return
+            try:
+                cells = self._get_voronoi_cells(centers, self._polygon)
+            except GEOSException:
+                return
+            centroids = centroid(cells)
+            next_centers = np.column_stack([get_x(centroids), get_y(centroids)])
+            # Cells clipped away entirely have no centroid; leave their centers put.
+            empty = np.isnan(next_centers[:, 0])
+            next_centers[empty] = centers[empty]
+
+            displacement = float(np.max(np.linalg.norm(next_centers - centers, axis=1)))
+            yield cells, next_centers, displacement
+            centers = next_centers
+            if displacement < tolerance:
+                return
@@ -3,65 +3,96 @@
 import json
 from math import floor
 import random
+import time
 from typing import Dict
 
 import numpy as np
-import pygame
-import pygame.freetype
-import pygame_gui
-from shapely.errors import GEOSException
 
 from get_param_defs import get_param_defs
 from param_def import ParamDef
 from param_set import ParamSet
 from param_set_defaults import default_param_set
+import randomizer
+from regeneration_scheduler import RegenerationScheduler
 from vein_renderer import VeinRenderer
-from screen_capturer import ScreenCapturer
-from slider_panel import SliderPanel
+from stage_timer import get_stage_timer
+from vector_exporter import VectorExporter
+from wing_bounds import RENDER_OFFSET, SCREEN_HEIGHT, SCREEN_WIDTH
+from wing_cache import WingCache
+from worker_pool import get_worker_pool, shutdown_worker_pool
 
-pygame.init()
-pygame.freetype.init()
-
-HUD_FONT = pygame.freetype.Font("DejaVuSansMono.ttf", 12)
 MAX_FPS = 60
-SCREEN_WIDTH = 1600
-SCREEN_HEIGHT = 900
 SLIDER_PANEL_WIDTH = 350
-
-TARGET_BOX = pygame.Rect((SCREEN_WIDTH/2, 20), (SCREEN_WIDTH/2 - 20, SCREEN_HEIGHT - 40))
-BASE_TARGET_BOX = pygame.Rect(
-  (SCREEN_WIDTH/2, SCREEN_HEIGHT * 0.2),
-  (200, SCREEN_HEIGHT * 0.6))
-RENDER_OFFSET = (SCREEN_WIDTH/2, 0)
+HUD_LINE_HEIGHT = 16
+HIGH_RES_SCALE = 8
 
 EDIT_MODE = "edit_mode"
 PREVIEW_MODE = "preview_mode"
 
-screen_capturer = ScreenCapturer("output/orthoptera_", ".png")
-export_capturer = ScreenCapturer("output/wing_", ".png")
+wing_cache = WingCache()
+stage_timer = get_stage_timer()
 
 param_defs:Dict[str, ParamDef] = get_param_defs()
 parameters:ParamSet = default_param_set()
 vein_renderer:VeinRenderer
+growth_animation = None
 
 mode = EDIT_MODE
 
 def render_hud(surf, fps):
     text_color = (255, 255, 255)
     text = f"FPS: {fps}"
+    if scheduler.pending:
+        text = f"Regenerating...  {text}"
     pos = (SCREEN_WIDTH - 10 - HUD_FONT.get_rect(text).width, 10)
     HUD_FONT.render_to(surf, pos, text, text_color)
 
-def parameters_changed(vein_renderer_invalid:bool=True):
-    global vein_renderer
-    if vein_renderer_invalid:
-        vein_renderer = VeinRenderer(parameters)
+    if stage_timer.enabled:
+        render_stage_timings(surf, text_color)
+
+def render_stage_timings(surf, text_color):
+    lines = [f"{'stage':<18}{'p50 ms':>9}{'p99 ms':>9}{'runs':>6}  last"]
+    for name, p50, p99, runs, counts in stage_timer.summary():
+        details = " ".join(f"{key}={value}" for key, value in counts.items() if key != "pid")
+        lines.append(f"{name:<18}{p50 * 1000:>9.2f}{p99 * 1000:>9.2f}{runs:>6}  {details}")
+    for i, line in enumerate(lines):
+        HUD_FONT.render_to(surf, (10, 10 + i * HUD_LINE_HEIGHT), line, text_color)
+
+def toggle_stage_timings():
+    stage_timer.enabled = not stage_timer.enabled
+    print(f"Stage timings {'on' if stage_timer.enabled else 'off'}")
+
+def export_trace():
+    if not stage_timer.enabled:
+        print("Stage timings are off; press T to start recording")
+        return
+    filename = time.strftime("output/trace_%Y%m%d_%H%M%S.json")
+    num_events = stage_timer.write_trace(filename)
+    print(f"Exported {num_events} trace events to {filename}")
+
+def parameters_changed():
+    scheduler.request_update(parameters)
+    slider_panel.set_parameters(parameters)
+
+def regeneration_finished():
+    """Swap in the wing the scheduler finished, if there is one."""
+    global vein_renderer, growth_animation
+    result = scheduler.poll()
+    if result is None:
+        return
+    vein_renderer, new_parameters = result
+    # Playback of the old wing would end on the wrong one.
+    growth_animation = None
+    parameters.clear()
+    parameters.update(new_parameters)
     slider_panel.set_parameters(parameters)
 
 def load_parameters():
     global parameters
     with open('parameters.json', 'r', encoding='utf-8') as f:
-        parameters = json.load(f)
+        # Files saved before a parameter existed get its default.
+        parameters = default_param_set()
+        parameters.update(json.load(f))
         parameters_changed()
     print("Loaded parameters.json")
 
@@ -70,70 +101,126 @@ def save_parameters():
         json.dump(parameters, f, indent=2)
     print("Saved parameters.json")
 
-def randomize_parameter(param_name:str):
-    param_def = param_defs[param_name]
-    random_value = random.uniform(param_def.range[0], param_def.range[1])
-    parameters[param_name] = random_value # type: ignore[literal-required]
-
-def randomize_base_parameters():
-    param_names = [
-      "root_segment_pos_linear_x",
-      "root_segment_pos_linear_y",
-      "root_segment_pos_quadratic_x",
-      "root_segment_pos_quadratic_y",
-    ]
-    attempts_remaining = 1000
-    while True:
-        attempts_remaining -= 1
-        if attempts_remaining < 0:
-            print("Max attempts reached.")
-            break
-        for param_name in param_names:
-            randomize_parameter(param_name)
-        try:
-            vein_renderer_check = VeinRenderer(parameters)
-            if not vein_renderer_check.is_base_contained_by(BASE_TARGET_BOX, RENDER_OFFSET):
-                print("Rejected wing base out of bounds.")
-            else:
-                print("Approved!")
-                break
-
-        except GEOSException:
-            print("GEOSException")
-    parameters_changed(False)
-
-def randomize_generation_parameters():
-    param_names = [
+# Jobs for the regeneration scheduler. Each runs in the background on copies
+# of the renderer and parameters.
+
+def randomize_base_parameters(_vein_renderer:VeinRenderer, job_parameters:ParamSet):
+    randomizer.randomize_base_parameters(job_parameters, param_defs)
+
+def randomize_generation_parameters(_vein_renderer:VeinRenderer, job_parameters:ParamSet):
+    randomizer.randomize_generation_parameters(job_parameters, param_defs)
+
+def randomize_primary_vein_parameters(_vein_renderer:VeinRenderer, job_parameters:ParamSet):
+    randomizer.randomize_primary_vein_parameters(job_parameters, param_defs)
+
+def generate_cross_veins(job_vein_renderer:VeinRenderer, job_parameters:ParamSet):
+    # A new pattern each time, kept in the parameters so saving them keeps it.
+    job_parameters["cross_vein_seed"] = random.getrandbits(32)
+    # Existing cross veins are regenerated by the update.
+    job_vein_renderer.update(job_parameters, get_worker_pool())
+    if not job_vein_renderer.has_cross_veins:
+        job_vein_renderer.generate_cross_veins(get_worker_pool())
+    stats = job_vein_renderer.get_relaxation_stats()
+    if stats:
+        iterations = [region_iterations for _, _, region_iterations, _ in stats]
+        print(f"Relaxed {len(stats)} regions in up to {max(iterations)} iterations "
+              f"(mean {sum(iterations) / len(iterations):.1f}, "
+              f"worst displacement {max(d for _, _, _, d in stats):.3f})")
+    if stage_timer.enabled:
+        for side, region, region_iterations, displacement in stats:
+            print(f"  {side} region {region}: {region_iterations} iterations "
+                  f"(displacement {displacement:.3f})")
+        print(f"Wing cache: {wing_cache.stats()}")
+
+def export_wing(surf):
+    result = pygame.Surface(screen.get_size())
+    result.fill((0, 0, 0))
+    result.blit(surf)
+
+    filename = export_capturer.capture(result, copy=False)
+    print(f"Exported image {filename}")
+
+def export_high_res_wing(job_vein_renderer:VeinRenderer, _parameters:ParamSet):
+    filename = export_capturer.next_filename()
+    exporter = TiledExporter(
+        job_vein_renderer, (SCREEN_WIDTH, SCREEN_HEIGHT), RENDER_OFFSET, HIGH_RES_SCALE)
+    exporter.write_png(filename)
+    width, height = exporter.size
+    print(f"Exported {width}x{height} image {filename}")
+
+def export_vector_wing():
+    svg_filename = vector_capturer.next_filename()
+    pdf_filename = svg_filename.removesuffix(".svg") + ".pdf"
+    exporter = VectorExporter(vein_renderer, screen.get_size(), RENDER_OFFSET)
+    exporter.write_svg(svg_filename)
+    exporter.write_pdf(pdf_filename)
+    print(f"Exported vector wing {svg_filename} and {pdf_filename}")
+
+def play_growth():
+    global growth_animation
+    growth_animation = GrowthAnimation(vein_renderer, screen.get_size(), RENDER_OFFSET)
+    print("Playing growth")
+
+def save_screenshot(surf):
+    filename = screen_capturer.capture(surf)
+    print(f"Saved screenshot {filename}")
+
+# Cross-vein workers import this module as well, so only the main process opens a
+# window or loads pygame and the UI.
+if __name__ == "__main__":
+    import pygame
+    import pygame.freetype
+    import pygame_gui
+
+    from growth_animation import GrowthAnimation
+    from screen_capturer import ScreenCapturer
+    from slider_panel import SliderPanel
+    from tiled_exporter import TiledExporter
+
+    screen_capturer = ScreenCapturer("output/orthoptera_", ".png")
+    export_capturer = ScreenCapturer("output/wing_", ".png")
+    vector_capturer = ScreenCapturer("output/vector_", ".svg")
+
+    pygame.init()
+    pygame.freetype.init()
+
+    HUD_FONT = pygame.freetype.Font("DejaVuSansMono.ttf", 12)
+
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+
+    pygame.display.set_caption("Orthoptera")
+    clock = pygame.time.Clock()
+    running:bool = True
+    dt:float = 0.0
+
+    uimanager = pygame_gui.UIManager((SCREEN_WIDTH, SCREEN_HEIGHT), theme_path="theme.json")
+    slider_panel = SliderPanel(
+        parameters=parameters,
+        relative_rect=pygame.Rect(
+            (SCREEN_WIDTH - 10 - SLIDER_PANEL_WIDTH, 25),
+            (SLIDER_PANEL_WIDTH, SCREEN_HEIGHT - 50)),
+            manager=uimanager)
+
+    slider_param_names = [
+        # "alpha",
+
+        "num_root_segments",
+        "cross_vein_density",
+
         "max_generations_const",
         "max_generations_linear",
-        "max_generations_quadratic"
-    ]
-    attempts_remaining = 1000
-    while True:
-        attempts_remaining -= 1
-        if attempts_remaining < 0:
-            print("Max attempts reached.")
-            break
-        for param_name in param_names:
-            randomize_parameter(param_name)
-        try:
-            vein_renderer_check = VeinRenderer(parameters)
-            if not vein_renderer_check.primary_vein_length_constraint():
-                print("Rejected short primary veins")
-            elif not vein_renderer_check.is_contained_by(TARGET_BOX, RENDER_OFFSET):
-                print("Rejected wing out of bounds.")
-            elif vein_renderer_check.has_collision():
-                print("Rejected overlapping primary veins.")
-            else:
-                print("Approved!")
-                parameters_changed(False)
-                break
-
-        except GEOSException:
-            print("GEOSException")
-
-def randomize_primary_vein_parameters():
-    param_names = [
+        "max_generations_quadratic",
+
+        # "root_segment_len",
+        # "segment_len_factor",
+
+        # "root_segment_pos_const_x",
+        # "root_segment_pos_const_y",
+        "root_segment_pos_linear_x",
+        "root_segment_pos_linear_y",
+        "root_segment_pos_quadratic_x",
+        "root_segment_pos_quadratic_y",
+
         "root_segment_dir_const_x",
         "root_segment_dir_const_y",
         "root_segment_dir_linear_x",
@@ -145,167 +232,95 @@ def randomize_primary_vein_parameters():
         "segment_dir_linear_y",
         "segment_dir_quadratic_x",
         "segment_dir_quadratic_y",
-        "segment_dir_a_x",
-        "segment_dir_a_y",
-        "segment_dir_b_x",
-        "segment_dir_b_y",
-        "segment_dir_c_x",
-        "segment_dir_c_y",
-        "segment_dir_d_x",
-        "segment_dir_d_y"
-    ]
-    attempts_remaining = 1000
-    while True:
-        attempts_remaining -= 1
-        if attempts_remaining < 0:
-            print("Max attempts reached.")
-            break
-        for param_name in param_names:
-            randomize_parameter(param_name)
-        try:
-            vein_renderer_check = VeinRenderer(parameters)
-            if not vein_renderer_check.is_contained_by(TARGET_BOX, RENDER_OFFSET):
-                print("Rejected wing out of bounds.")
-            elif vein_renderer_check.has_collision():
-                print("Rejected overlapping primary veins.")
-            else:
-                print("Approved!")
-                parameters_changed(False)
-                break
-
-        except GEOSException:
-            print("GEOSException")
 
-def export_wing(surf):
-    result = pygame.Surface(screen.get_size())
-    result.fill((0, 0, 0))
-    result.blit(surf)
+        # "segment_dir_a_x",
+        # "segment_dir_a_y",
+        # "segment_dir_b_x",
+        # "segment_dir_b_y",
+        # "segment_dir_c_x",
+        # "segment_dir_c_y",
+        # "segment_dir_d_x",
+        # "segment_dir_d_y",
+    ]
+    for name in slider_param_names:
+        slider_panel.add_slider(param_defs[name])
 
-    filename = export_capturer.capture(result)
-    print(f"Exported image {filename}")
+    fps_array:list[float] = []
 
-def save_screenshot(surf):
-    filename = screen_capturer.capture(surf)
-    print(f"Saved screenshot {filename}")
+    vein_renderer = VeinRenderer(parameters, wing_cache)
+    scheduler = RegenerationScheduler(vein_renderer, parameters)
 
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-wing_surf = pygame.Surface(screen.get_size())
-wing_surf = wing_surf.convert_alpha()
-
-pygame.display.set_caption("Orthoptera")
-clock = pygame.time.Clock()
-running:bool = True
-dt:float = 0.0
-
-uimanager = pygame_gui.UIManager((SCREEN_WIDTH, SCREEN_HEIGHT), theme_path="theme.json")
-slider_panel = SliderPanel(
-    parameters=parameters,
-    relative_rect=pygame.Rect(
-        (SCREEN_WIDTH - 10 - SLIDER_PANEL_WIDTH, 25),
-        (SLIDER_PANEL_WIDTH, SCREEN_HEIGHT - 50)),
-        manager=uimanager)
-
-slider_param_names = [
-    # "alpha",
-
-    "num_root_segments",
-    "cross_vein_density",
-
-    "max_generations_const",
-    "max_generations_linear",
-    "max_generations_quadratic",
-
-    # "root_segment_len",
-    # "segment_len_factor",
-
-    # "root_segment_pos_const_x",
-    # "root_segment_pos_const_y",
-    "root_segment_pos_linear_x",
-    "root_segment_pos_linear_y",
-    "root_segment_pos_quadratic_x",
-    "root_segment_pos_quadratic_y",
-
-    "root_segment_dir_const_x",
-    "root_segment_dir_const_y",
-    "root_segment_dir_linear_x",
-    "root_segment_dir_linear_y",
-    "root_segment_dir_quadratic_x",
-    "root_segment_dir_quadratic_y",
-
-    "segment_dir_linear_x",
-    "segment_dir_linear_y",
-    "segment_dir_quadratic_x",
-    "segment_dir_quadratic_y",
-
-    # "segment_dir_a_x",
-    # "segment_dir_a_y",
-    # "segment_dir_b_x",
-    # "segment_dir_b_y",
-    # "segment_dir_c_x",
-    # "segment_dir_c_y",
-    # "segment_dir_d_x",
-    # "segment_dir_d_y",
-]
-for name in slider_param_names:
-    slider_panel.add_slider(param_defs[name])
-
-fps_array:list[float] = []
-
-parameters_changed()
-
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
                 running = False
-            elif event.key == pygame.K_l:
-                load_parameters()
-                parameters_changed()
-            elif event.key == pygame.K_1:
-                randomize_base_parameters()
-            elif event.key == pygame.K_2:
-                randomize_primary_vein_parameters()
-                parameters_changed()
-            elif event.key == pygame.K_3:
-                randomize_generation_parameters()
-                parameters_changed()
-            elif event.key == pygame.K_4:
-                vein_renderer.generate_cross_veins()
-            elif event.key == pygame.K_r:
-                save_screenshot(screen)
-            elif event.key == pygame.K_v:
-                save_parameters()
-            elif event.key == pygame.K_x:
-                export_wing(wing_surf)
-            elif event.key == pygame.K_m:
-                if mode == EDIT_MODE:
-                    mode = PREVIEW_MODE
-                elif mode == PREVIEW_MODE:
-                    mode = EDIT_MODE
-
-        slider_panel.process_events(event, parameters_changed)
-        uimanager.process_events(event)
-
-    uimanager.update(dt)
-
-    screen.fill("black")
-
-    wing_surf.fill((0, 0, 0, 0))
-    vein_renderer.render_to(wing_surf, RENDER_OFFSET)
-    screen.blit(wing_surf)
-
-    render_hud(screen, floor(np.average(fps_array)) if fps_array else 0)
-
-    if mode == EDIT_MODE:
-        uimanager.draw_ui(screen)
-
-    pygame.display.flip()
-
-    dt = float(clock.tick(MAX_FPS)) / 1000.0
-
-    fps_array.append(1 / dt)
-    fps_array = fps_array[:10]
-
-pygame.quit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_l:
+                    load_parameters()
+                    parameters_changed()
+                elif event.key == pygame.K_1:
+                    scheduler.request(randomize_base_parameters)
+                elif event.key == pygame.K_2:
+                    scheduler.request(randomize_primary_vein_parameters)
+                elif event.key == pygame.K_3:
+                    scheduler.request(randomize_generation_parameters)
+                elif event.key == pygame.K_4:
+                    scheduler.request(generate_cross_veins)
+                elif event.key == pygame.K_r:
+                    save_screenshot(screen)
+                elif event.key == pygame.K_v:
+                    save_parameters()
+                elif event.key == pygame.K_x:
+                    export_wing(vein_renderer.get_surface(screen.get_size(), RENDER_OFFSET))
+                elif event.key == pygame.K_h:
+                    scheduler.request(export_high_res_wing)
+                elif event.key == pygame.K_s:
+                    export_vector_wing()
+                elif event.key == pygame.K_t:
+                    toggle_stage_timings()
+                elif event.key == pygame.K_e:
+                    export_trace()
+                elif event.key == pygame.K_g:
+                    play_growth()
+                elif event.key == pygame.K_m:
+                    if mode == EDIT_MODE:
+                        mode = PREVIEW_MODE
+                    elif mode == PREVIEW_MODE:
+                        mode = EDIT_MODE
+
+            slider_panel.process_events(event, parameters_changed)
+            uimanager.process_events(event)
+
+        regeneration_finished()
+        uimanager.update(dt)
+
+        screen.fill("black")
+
+        if growth_animation is not None:
+            wing_surface = growth_animation.advance()
+            if growth_animation.done:
+                growth_animation = None
+        else:
+            wing_surface = vein_renderer.get_surface(screen.get_size(), RENDER_OFFSET)
+        with stage_timer.stage("blit"):
+            screen.blit(wing_surface)
+
+        render_hud(screen, floor(np.average(fps_array)) if fps_array else 0)
+
+        if mode == EDIT_MODE:
+            uimanager.draw_ui(screen)
+
+        pygame.display.flip()
+
+        dt = float(clock.tick(MAX_FPS)) / 1000.0
+
+        fps_array.append(1 / dt)
+        fps_array = fps_array[-10:]
+
+    scheduler.shutdown()
+    for capturer in (screen_capturer, export_capturer, vector_capturer):
+        capturer.flush()
+    shutdown_worker_pool()
+    pygame.quit()
@@ -0,0 +1,135 @@
+#!./venv/bin/python3
+
+"""Export a frame sequence that morphs between two sets of parameters.
+
+The parameters are interpolated over the frames and each frame's wing is
+updated from the one before: only the veins that moved are grown again, and
+cross veins are relaxed from the centers of the previous frame, so the cells
+follow the wing instead of jumping about. Frames are written as numbered PNGs
+by a pool of writer threads with a bounded queue, so memory use doesn't grow
+with the number of frames.
+
+    ./morph_export.py --start parameters.json --frames 240 --prefix output/morph_
+    ffmpeg -framerate 60 -i output/morph_%05d.png morph.mp4
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from get_param_defs import get_param_defs
+from param_def import ParamDef
+from param_set import ParamSet
+from param_set_defaults import default_param_set
+from vein_renderer import VeinRenderer
+from wing_bounds import RENDER_OFFSET, SCREEN_HEIGHT, SCREEN_WIDTH
+
+# Kept from the start parameters, so every frame relaxes the same pattern.
+FIXED_PARAM_NAMES = {"cross_vein_seed"}
+
+def interpolate_parameters(
+        start:ParamSet,
+        end:ParamSet,
+        t:float,
+        param_defs:dict[str, ParamDef]) -> ParamSet:
+    """The parameters a fraction `t` of the way from `start` to `end`, with
+    int parameters rounded."""
+    result = ParamSet(**start)
+    for name, value in start.items():
+        if name in FIXED_PARAM_NAMES:
+            continue
+        mixed = value + (end[name] - value) * t # type: ignore[literal-required]
+        param_def = param_defs.get(name)
+        if param_def is not None and param_def.type == 'int':
+            mixed = round(mixed)
+        result[name] = mixed # type: ignore[literal-required]
+    return result
+
+def load_parameters(filename:str | None) -> ParamSet:
+    parameters = default_param_set()
+    if filename:
+        with open(filename, 'r', encoding='utf-8') as f:
+            parameters.update(json.load(f))
+    return parameters
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--start", default="parameters.json",
+        help="JSON parameter file of the first frame")
+    parser.add_argument(
+        "--end", help="JSON parameter file of the last frame (defaults to the built-in defaults)")
+    parser.add_argument("--frames", type=int, default=120, help="number of frames to write")
+    parser.add_argument("--prefix", default="output/morph_", help="output filename prefix")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1,
+        help="processes relaxing the cross vein regions of each frame")
+    parser.add_argument("--writers", type=int, default=2, help="threads encoding PNGs")
+    args = parser.parse_args()
+    if args.frames < 1:
+        parser.error("--frames must be at least 1")
+
+    # Region workers import this module as well, so only the main process
+    # loads pygame.
+    import pygame
+    from screen_capturer import ScreenCapturer
+
+    param_defs = get_param_defs()
+    start_parameters = load_parameters(args.start)
+    end_parameters = load_parameters(args.end)
+    os.makedirs(os.path.dirname(args.prefix) or ".", exist_ok=True)
+    capturer = ScreenCapturer(args.prefix, ".png", max_workers=args.writers)
+
+    executor = None
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context('spawn'))
+
+    pygame.init()
+    vein_renderer: VeinRenderer | None = None
+    geometry_time = 0.0
+    render_time = 0.0
+    start = time.perf_counter()
+    for i in range(args.frames):
+        t = i / (args.frames - 1) if args.frames > 1 else 0.0
+        parameters = interpolate_parameters(start_parameters, end_parameters, t, param_defs)
+
+        frame_start = time.perf_counter()
+        if vein_renderer is None:
+            vein_renderer = VeinRenderer(parameters)
+            vein_renderer.generate_cross_veins(executor)
+        else:
+            vein_renderer.update(parameters, executor, warm_start=True)
+        geometry_end = time.perf_counter()
+        geometry_time += geometry_end - frame_start
+
+        frame = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        frame.fill((0, 0, 0))
+        frame.blit(vein_renderer.get_surface(frame.get_size(), RENDER_OFFSET))
+        # Waits here while the writers are a full queue behind.
+        capturer.write(frame, f"{args.prefix}{str(i).zfill(5)}.png", copy=False)
+        render_time += time.perf_counter() - geometry_end
+
+        if (i + 1) % max(args.frames // 10, 1) == 0 or i + 1 == args.frames:
+            elapsed = time.perf_counter() - start
+            print(f"Frame {i + 1} of {args.frames} ({(i + 1) / elapsed:.1f} frames/sec)")
+
+    capturer.flush()
+    elapsed = time.perf_counter() - start
+    if executor is not None:
+        executor.shutdown()
+    pygame.quit()
+
+    print(f"Wrote {args.frames} frames to {args.prefix}*.png in {elapsed:.1f}s "
+          f"({args.frames / elapsed:.1f} frames/sec)")
+    print(f"  geometry  {geometry_time / args.frames * 1000:>8.1f} ms/frame")
+    print(f"  render    {render_time / args.frames * 1000:>8.1f} ms/frame, including queue waits")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
-import pygame
+import numpy as np
 
 def param_to_vector2(parameters, prefix):
-    return pygame.Vector2(parameters[f"{prefix}_x"], parameters[f"{prefix}_y"])
+    return np.array([parameters[f"{prefix}_x"], parameters[f"{prefix}_y"]], dtype=float)
 
 def quadratic_param_to_vector2(parameters, x):
     return param_to_vector2(parameters, 'quadratic') * pow(x, 2) + \
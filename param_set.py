@@ -34,3 +34,4 @@ class ParamSet(TypedDict):
     max_generations_linear: float
     max_generations_quadratic: float
     cross_vein_density: float
+    cross_vein_seed: int
@@ -34,5 +34,6 @@ def default_param_set():
         max_generations_const=12,
         max_generations_linear=0.0,
         max_generations_quadratic=0.0,
-        cross_vein_density=0.000845
+        cross_vein_density=0.000845,
+        cross_vein_seed=0
     )
@@ -0,0 +1,258 @@
+#!./venv/bin/python3
+
+"""Map where in parameter space wings pass their constraints.
+
+Samples a grid, Latin hypercube or Sobol design over any of the parameters in
+get_param_defs, holding the rest at their starting values. Each sample is
+checked against the base bounds, wing bounds, vein collision and vein length
+constraints, across a pool of worker processes.
+
+Samples and results are kept in a memory-mapped .npy file with one row per
+sample, with a JSON file describing the sweep beside it. Running the same
+command again resumes an interrupted sweep. The results can be sliced and
+plotted without loading the whole file:
+
+    ./parameter_sweep.py --names root_segment_pos_linear_x root_segment_len \\
+        --design sobol --samples 1048576 --output output/sweep.npy
+    results = np.load("output/sweep.npy", mmap_mode="r")
+    feasible = results[results["feasible"]]
+
+Sobol designs need scipy.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import importlib.util
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from batch_evaluator import CandidateBatch, evaluate_constraints
+from get_param_defs import get_param_defs
+from param_def import ParamDef
+from param_set import ParamSet
+from param_set_defaults import default_param_set
+from wing_bounds import BASE_TARGET_BOX, RENDER_OFFSET, TARGET_BOX
+
+DESIGNS = ["grid", "lhs", "sobol"]
+
+# Keyed by the VeinRenderer methods they match.
+CONSTRAINTS = [
+    "is_base_contained_by",
+    "is_contained_by",
+    "has_collision",
+    "primary_vein_length_constraint",
+]
+
+# Rows given to a worker at a time, and written to the file at a time when
+# the design is laid out. A power of two keeps Sobol draws balanced.
+CHUNK_ROWS = 4096
+
+def sweep_dtype(names:list[str]) -> np.dtype:
+    return np.dtype(
+        [(name, np.float64) for name in names] +
+        [(name, np.bool_) for name in CONSTRAINTS] +
+        [("feasible", np.bool_), ("evaluated", np.bool_)])
+
+def design_size(design:str, names:list[str], param_defs:dict[str, ParamDef], samples:int,
+                levels:int) -> int:
+    if design == "grid":
+        return int(np.prod([len(grid_levels(param_defs[name], levels)) for name in names]))
+    return samples
+
+def grid_levels(param_def:ParamDef, levels:int) -> np.ndarray:
+    low, high = param_def.range
+    if param_def.type == 'int':
+        return np.unique(np.round(np.linspace(low, high, min(levels, int(high - low) + 1))))
+    return np.linspace(low, high, levels)
+
+def write_design(
+        results:np.ndarray,
+        design:str,
+        names:list[str],
+        param_defs:dict[str, ParamDef],
+        levels:int,
+        seed:int | None):
+    """Fill in the parameter columns of every row, a chunk at a time."""
+    n = len(results)
+    rng = np.random.default_rng(seed)
+    if design == "grid":
+        axes = [grid_levels(param_defs[name], levels) for name in names]
+        for start in range(0, n, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, n)
+            rows = np.arange(start, stop)
+            # The last name varies fastest.
+            for name, axis in zip(names[::-1], axes[::-1]):
+                results[name][start:stop] = axis[rows % len(axis)]
+                rows = rows // len(axis)
+    elif design == "lhs":
+        # One stratum per sample along every axis, in an independent order.
+        for name in names:
+            strata = rng.permutation(n)
+            for start in range(0, n, CHUNK_ROWS):
+                stop = min(start + CHUNK_ROWS, n)
+                unit = (strata[start:stop] + rng.uniform(size=stop - start)) / n
+                results[name][start:stop] = _from_unit(unit, param_defs[name])
+    elif design == "sobol":
+        from scipy.stats import qmc
+        sampler = qmc.Sobol(len(names), seed=rng)
+        for start in range(0, n, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, n)
+            unit = sampler.random(CHUNK_ROWS)[:stop - start]
+            for i, name in enumerate(names):
+                results[name][start:stop] = _from_unit(unit[:, i], param_defs[name])
+
+def _from_unit(unit:np.ndarray, param_def:ParamDef) -> np.ndarray:
+    low, high = param_def.range
+    if param_def.type == 'int':
+        # Equal shares of the unit interval for every integer in the range.
+        return np.minimum(np.floor(low + unit * (high - low + 1)), high)
+    return low + unit * (high - low)
+
+def evaluate_rows(filename:str, start:int, stop:int, parameters:ParamSet, names:list[str]) -> int:
+    """Check the constraints for rows [start, stop) and write the results back
+    into the file. Returns how many of them are feasible."""
+    results = open_memmap(filename, mode='r+')
+    rows = results[start:stop]
+    num_root_segments = rows["num_root_segments"] if "num_root_segments" in names else \
+        np.full(len(rows), parameters["num_root_segments"])
+    # Candidates in a batch share a vein count.
+    for count in np.unique(num_root_segments):
+        group = np.nonzero(num_root_segments == count)[0]
+        batch_parameters = dict(parameters)
+        for name in names:
+            batch_parameters[name] = np.array(rows[name][group])
+        batch_parameters["num_root_segments"] = int(count)
+        constraints = evaluate_constraints(
+            CandidateBatch(batch_parameters, len(group)),
+            TARGET_BOX, BASE_TARGET_BOX, RENDER_OFFSET)
+        for name, values in constraints.items():
+            rows[name][group] = values
+    rows["feasible"] = rows["is_base_contained_by"] & rows["is_contained_by"] & \
+        ~rows["has_collision"] & rows["primary_vein_length_constraint"]
+    rows["evaluated"] = True
+    results.flush()
+    return int(np.count_nonzero(rows["feasible"]))
+
+def create_sweep(filename:str, spec:dict, param_defs:dict[str, ParamDef]) -> np.ndarray:
+    names = spec["names"]
+    n = design_size(spec["design"], names, param_defs, spec["samples"], spec["levels"])
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    results = open_memmap(filename, mode='w+', dtype=sweep_dtype(names), shape=(n,))
+    write_design(results, spec["design"], names, param_defs, spec["levels"], spec["seed"])
+    results.flush()
+    with open(spec_filename(filename), 'w', encoding='utf-8') as f:
+        json.dump(spec, f, indent=2)
+    return results
+
+def spec_filename(filename:str) -> str:
+    return os.path.splitext(filename)[0] + ".json"
+
+def print_summary(results:np.ndarray, names:list[str]):
+    n = len(results)
+    counts = dict.fromkeys(CONSTRAINTS + ["feasible"], 0)
+    lower = dict.fromkeys(names, np.inf)
+    upper = dict.fromkeys(names, -np.inf)
+    for start in range(0, n, CHUNK_ROWS * 16):
+        rows = results[start:start + CHUNK_ROWS * 16]
+        for name in counts:
+            counts[name] += int(np.count_nonzero(rows[name]))
+        feasible = rows[rows["feasible"]]
+        if len(feasible) > 0:
+            for name in names:
+                lower[name] = min(lower[name], float(feasible[name].min()))
+                upper[name] = max(upper[name], float(feasible[name].max()))
+
+    print(f"{counts['feasible']} of {n} samples feasible ({counts['feasible'] / max(n, 1):.1%})")
+    for name in CONSTRAINTS:
+        print(f"  {counts[name] / max(n, 1):>7.1%}  {name}")
+    if counts["feasible"] > 0:
+        print("Feasible ranges:")
+        for name in names:
+            print(f"  {name:<32} {lower[name]:>12.6g} to {upper[name]:.6g}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--names", nargs="+", help="parameters to sweep over their ranges")
+    parser.add_argument("--design", choices=DESIGNS, default="lhs")
+    parser.add_argument(
+        "--samples", type=int, default=4096, help="number of samples for lhs and sobol designs")
+    parser.add_argument(
+        "--levels", type=int, default=16,
+        help="values per parameter for grid designs, fewer for short int ranges")
+    parser.add_argument("--seed", type=int, help="random seed for lhs and sobol designs")
+    parser.add_argument(
+        "--parameters",
+        help="JSON parameter file to hold the other parameters at "
+             "(defaults to the built-in defaults)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--output", default="output/sweep.npy", help="results file to write or resume")
+    args = parser.parse_args()
+
+    param_defs = get_param_defs()
+    if os.path.exists(args.output):
+        with open(spec_filename(args.output), 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+        results = open_memmap(args.output, mode='r')
+        print(f"Resuming {args.output}: {spec['design']} design over {', '.join(spec['names'])}")
+    else:
+        if not args.names:
+            parser.error("--names is required to start a new sweep")
+        unknown = [name for name in args.names if name not in param_defs]
+        if unknown:
+            parser.error(f"unknown parameters: {', '.join(unknown)}")
+        if args.design == "sobol" and importlib.util.find_spec("scipy") is None:
+            parser.error("sobol designs need scipy (pip install scipy)")
+        parameters = default_param_set()
+        if args.parameters:
+            with open(args.parameters, 'r', encoding='utf-8') as f:
+                parameters.update(json.load(f))
+        spec = {
+            "names": args.names,
+            "design": args.design,
+            "samples": args.samples,
+            "levels": args.levels,
+            "seed": args.seed,
+            "parameters": parameters,
+        }
+        results = create_sweep(args.output, spec, param_defs)
+        print(f"Created {args.output}: {len(results)} samples")
+
+    names = spec["names"]
+    n = len(results)
+    pending = [
+        (start, min(start + CHUNK_ROWS, n)) for start in range(0, n, CHUNK_ROWS)
+        if not np.all(results["evaluated"][start:start + CHUNK_ROWS])]
+    del results
+    num_rows = sum(stop - start for start, stop in pending)
+    print(f"Evaluating {num_rows} samples in {len(pending)} chunks")
+
+    start_time = time.perf_counter()
+    done = 0
+    jobs = [(args.output, start, stop, spec["parameters"], names) for start, stop in pending]
+    if args.workers <= 1:
+        completed = ((job[2] - job[1], evaluate_rows(*job)) for job in jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context('spawn'))
+        futures = {executor.submit(evaluate_rows, *job): job[2] - job[1] for job in jobs}
+        completed = ((futures[future], future.result()) for future in as_completed(futures))
+
+    for rows, _ in completed:
+        done += rows
+        elapsed = time.perf_counter() - start_time
+        print(f"Evaluated {done} of {num_rows} samples ({done / elapsed:.0f} samples/sec)")
+    if executor is not None:
+        executor.shutdown()
+
+    print_summary(open_memmap(args.output, mode='r'), names)
+
+if __name__ == "__main__":
+    main()
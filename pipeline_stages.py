@@ -0,0 +1,64 @@
+from typing import Dict, Iterable
+
+ROOT_PLACEMENT = "root_placement"
+VEIN_GROWTH = "vein_growth"
+REGION_POLYGONS = "region_polygons"
+SEEDING = "seeding"
+LLOYD = "lloyd"
+RENDER = "render"
+
+# Each stage consumes the output of the one before it.
+STAGES = [ROOT_PLACEMENT, VEIN_GROWTH, REGION_POLYGONS, SEEDING, LLOYD, RENDER]
+
+# The first stage each parameter feeds. Every stage after it is invalidated too.
+PARAM_STAGES: Dict[str, str] = {
+    "alpha": RENDER,
+    "num_root_segments": ROOT_PLACEMENT,
+    "root_segment_pos_const_x": ROOT_PLACEMENT,
+    "root_segment_pos_const_y": ROOT_PLACEMENT,
+    "root_segment_pos_linear_x": ROOT_PLACEMENT,
+    "root_segment_pos_linear_y": ROOT_PLACEMENT,
+    "root_segment_pos_quadratic_x": ROOT_PLACEMENT,
+    "root_segment_pos_quadratic_y": ROOT_PLACEMENT,
+    "root_segment_len": VEIN_GROWTH,
+    "root_segment_dir_const_x": VEIN_GROWTH,
+    "root_segment_dir_const_y": VEIN_GROWTH,
+    "root_segment_dir_linear_x": VEIN_GROWTH,
+    "root_segment_dir_linear_y": VEIN_GROWTH,
+    "root_segment_dir_quadratic_x": VEIN_GROWTH,
+    "root_segment_dir_quadratic_y": VEIN_GROWTH,
+    "segment_dir_linear_x": VEIN_GROWTH,
+    "segment_dir_linear_y": VEIN_GROWTH,
+    "segment_dir_quadratic_x": VEIN_GROWTH,
+    "segment_dir_quadratic_y": VEIN_GROWTH,
+    "segment_dir_a_x": VEIN_GROWTH,
+    "segment_dir_a_y": VEIN_GROWTH,
+    "segment_dir_b_x": VEIN_GROWTH,
+    "segment_dir_b_y": VEIN_GROWTH,
+    "segment_dir_c_x": VEIN_GROWTH,
+    "segment_dir_c_y": VEIN_GROWTH,
+    "segment_dir_d_x": VEIN_GROWTH,
+    "segment_dir_d_y": VEIN_GROWTH,
+    "segment_len_factor": VEIN_GROWTH,
+    "max_generations_const": VEIN_GROWTH,
+    "max_generations_linear": VEIN_GROWTH,
+    "max_generations_quadratic": VEIN_GROWTH,
+    "cross_vein_density": SEEDING,
+    "cross_vein_seed": SEEDING,
+}
+
+# Not read by any stage.
+UNUSED_PARAMS = {"root_segment_len_factor"}
+
+def changed_parameters(old:dict, new:dict) -> set[str]:
+    return {name for name in old.keys() | new.keys() if old.get(name) != new.get(name)}
+
+def invalidated_stages(param_names:Iterable[str]) -> list[str]:
+    """The stages that have to run again after the named parameters change.
+    Parameters nothing is known about invalidate everything."""
+    first = len(STAGES)
+    for name in param_names:
+        if name in UNUSED_PARAMS:
+            continue
+        first = min(first, STAGES.index(PARAM_STAGES.get(name, ROOT_PLACEMENT)))
+    return STAGES[first:]
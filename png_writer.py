@@ -0,0 +1,49 @@
+import struct
+import zlib
+
+import numpy as np
+import pygame
+
+# Rows read from a surface at a time by `write_png`.
+BAND_HEIGHT = 64
+
+class PngWriter:
+    """Writes an 8-bit RGB PNG a band of rows at a time."""
+
+    def __init__(self, f, width:int, height:int):
+        self._f = f
+        self._width = width
+        self._compressor = zlib.compressobj()
+        f.write(b"\x89PNG\r\n\x1a\n")
+        # 8-bit RGB, no interlacing.
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def write_rows(self, rows:bytes | np.ndarray):
+        """Append whole rows of packed RGB pixels, top to bottom."""
+        rows = np.frombuffer(rows, dtype=np.uint8).reshape(-1, self._width * 3)
+        # Every scanline starts with its filter type, 0 for none.
+        scanlines = np.zeros((len(rows), self._width * 3 + 1), dtype=np.uint8)
+        scanlines[:, 1:] = rows
+        data = self._compressor.compress(scanlines.tobytes())
+        if data:
+            self._write_chunk(b"IDAT", data)
+
+    def finish(self):
+        self._write_chunk(b"IDAT", self._compressor.flush())
+        self._write_chunk(b"IEND", b"")
+
+    def _write_chunk(self, chunk_type:bytes, data:bytes):
+        self._f.write(struct.pack(">I", len(data)))
+        self._f.write(chunk_type)
+        self._f.write(data)
+        self._f.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+def write_png(filename:str, surf:pygame.Surface):
+    """Save `surf` as a PNG, a band of rows at a time."""
+    width, height = surf.get_size()
+    with open(filename, 'wb') as f:
+        writer = PngWriter(f, width, height)
+        for top in range(0, height, BAND_HEIGHT):
+            band = surf.subsurface((0, top, width, min(BAND_HEIGHT, height - top)))
+            writer.write_rows(pygame.image.tobytes(band, "RGB"))
+        writer.finish()
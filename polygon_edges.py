@@ -0,0 +1,39 @@
+import numpy as np
+import shapely
+from shapely import get_coordinates, get_exterior_ring, get_num_coordinates, get_parts, \
+    line_merge
+
+# Edges are matched after rounding to this many decimal places, so the two
+# copies of a shared edge still match if clipping moved one of them slightly.
+EDGE_DECIMALS = 6
+
+def unique_edges(polygons) -> np.ndarray:
+    """Every edge of the polygons' exterior rings, once, as an (n, 2, 2) array.
+
+    Neighbouring cells share edges, which they list in opposite directions.
+    Each edge is put into a canonical direction before duplicates are removed."""
+    rings = get_exterior_ring(np.asarray(polygons, dtype=object))
+    rings = rings[get_num_coordinates(rings) > 0]
+    if len(rings) == 0:
+        return np.empty((0, 2, 2))
+    coords, ring_index = get_coordinates(rings, return_index=True)
+    same_ring = ring_index[:-1] == ring_index[1:]
+    edges = np.stack([coords[:-1][same_ring], coords[1:][same_ring]], axis=1)
+
+    # Lexicographically smallest endpoint first.
+    flip = (edges[:, 0, 0] > edges[:, 1, 0]) | \
+        ((edges[:, 0, 0] == edges[:, 1, 0]) & (edges[:, 0, 1] > edges[:, 1, 1]))
+    edges[flip] = edges[flip, ::-1]
+    keys = np.round(edges.reshape(-1, 4), EDGE_DECIMALS)
+    nondegenerate = np.any(keys[:, :2] != keys[:, 2:], axis=1)
+    _, first = np.unique(keys[nondegenerate], axis=0, return_index=True)
+    return edges[nondegenerate][np.sort(first)]
+
+def merged_edges(polygons) -> list[np.ndarray]:
+    """The polygons' unique edges joined end to end into as few polylines as
+    possible, each as an (n, 2) array of points."""
+    edges = unique_edges(polygons)
+    if len(edges) == 0:
+        return []
+    merged = line_merge(shapely.multilinestrings(shapely.linestrings(edges)))
+    return [get_coordinates(line) for line in get_parts(merged)]
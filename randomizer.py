@@ -0,0 +1,148 @@
+from collections import Counter
+import random
+from typing import Dict
+
+import numpy as np
+
+from base_sampler import sample_base_parameters
+from batch_evaluator import CandidateBatch, draw_candidates, evaluate_candidates
+from param_def import ParamDef
+from param_set import ParamSet
+from stage_timer import get_stage_timer
+from vein_grower import BOUNDS_CONSTRAINT, COLLISION_CONSTRAINT, LENGTH_CONSTRAINT, \
+    GrowthFailure, VeinGrower
+from wing_bounds import BASE_TARGET_BOX, RENDER_OFFSET, TARGET_BOX
+
+MAX_ATTEMPTS = 1000
+BATCH_SIZE = 64
+
+GENERATION_PARAM_NAMES = [
+    "max_generations_const",
+    "max_generations_linear",
+    "max_generations_quadratic"
+]
+
+PRIMARY_VEIN_PARAM_NAMES = [
+    "root_segment_dir_const_x",
+    "root_segment_dir_const_y",
+    "root_segment_dir_linear_x",
+    "root_segment_dir_linear_y",
+    "root_segment_dir_quadratic_x",
+    "root_segment_dir_quadratic_y",
+
+    "segment_dir_linear_x",
+    "segment_dir_linear_y",
+    "segment_dir_quadratic_x",
+    "segment_dir_quadratic_y",
+    "segment_dir_a_x",
+    "segment_dir_a_y",
+    "segment_dir_b_x",
+    "segment_dir_b_y",
+    "segment_dir_c_x",
+    "segment_dir_c_y",
+    "segment_dir_d_x",
+    "segment_dir_d_y"
+]
+
+REJECTED_BASE_OUT_OF_BOUNDS = "Rejected wing base out of bounds."
+REJECTED_SHORT_PRIMARY_VEINS = "Rejected short primary veins"
+REJECTED_OUT_OF_BOUNDS = "Rejected wing out of bounds."
+REJECTED_COLLISION = "Rejected overlapping primary veins."
+REJECTED_GEOS_EXCEPTION = "GEOSException"
+
+# Only the roots are checked, against the smaller base box.
+BASE_BOUNDS_CONSTRAINT = "base_bounds"
+
+REJECTIONS = {
+    BASE_BOUNDS_CONSTRAINT: REJECTED_BASE_OUT_OF_BOUNDS,
+    LENGTH_CONSTRAINT: REJECTED_SHORT_PRIMARY_VEINS,
+    BOUNDS_CONSTRAINT: REJECTED_OUT_OF_BOUNDS,
+    COLLISION_CONSTRAINT: REJECTED_COLLISION,
+}
+
+def randomize_parameter(parameters:ParamSet, param_defs:Dict[str, ParamDef], param_name:str):
+    param_def = param_defs[param_name]
+    random_value = random.uniform(param_def.range[0], param_def.range[1])
+    parameters[param_name] = random_value # type: ignore[literal-required]
+
+def check_wing(parameters:ParamSet) -> GrowthFailure | None:
+    """Grow the veins and return the first constraint they violate, if any."""
+    return VeinGrower(parameters, TARGET_BOX, RENDER_OFFSET).grow()
+
+def _randomize_until_approved(
+        parameters:ParamSet,
+        param_defs:Dict[str, ParamDef],
+        param_names:list[str],
+        evaluate,
+        rejections:Counter | None,
+        verbose:bool) -> bool:
+    """Draw candidates in batches until one passes `evaluate`, which maps a
+    `CandidateBatch` to the constraint each candidate violates. The first
+    accepted candidate is copied into `parameters`; if none is found within
+    MAX_ATTEMPTS the last one tried is kept, as it always has been."""
+    # Seeded from `random` so a seeded run stays reproducible.
+    rng = np.random.default_rng(random.getrandbits(64))
+    outcomes:Counter = Counter()
+    num_evaluated = 0
+    approved = False
+    while not approved and num_evaluated < MAX_ATTEMPTS:
+        size = min(BATCH_SIZE, MAX_ATTEMPTS - num_evaluated)
+        with get_stage_timer().stage("randomize", candidates=size) as timing:
+            batch = draw_candidates(parameters, param_defs, param_names, size, rng)
+            constraints = evaluate(batch)
+            timing.count(accepted=constraints.count(None))
+        outcomes.update(constraints)
+        num_evaluated += size
+
+        approved = None in constraints
+        parameters.update(batch.candidate(constraints.index(None) if approved else size - 1))
+
+    rejected = Counter({REJECTIONS[c]: n for c, n in outcomes.items() if c is not None})
+    if rejections is not None:
+        rejections.update(rejected)
+    if verbose:
+        print("Approved!" if approved else "Max attempts reached.")
+        print(f"{outcomes[None]} of {num_evaluated} candidates accepted "
+              f"({outcomes[None] / num_evaluated:.1%})")
+        for reason, count in rejected.most_common():
+            print(f"  {count:>8}  {reason}")
+    return approved
+
+def _evaluate_primary_veins(batch:CandidateBatch) -> list[str | None]:
+    return evaluate_candidates(batch, TARGET_BOX, RENDER_OFFSET, check_length=False)
+
+def _evaluate_wing(batch:CandidateBatch) -> list[str | None]:
+    return evaluate_candidates(batch, TARGET_BOX, RENDER_OFFSET)
+
+def randomize_base_parameters(
+        parameters:ParamSet,
+        param_defs:Dict[str, ParamDef],
+        rejections:Counter | None = None,
+        verbose:bool = True) -> bool:
+    """Draw the root position parameters straight from the values that keep
+    the wing base inside BASE_TARGET_BOX, so there's nothing to reject."""
+    rng = np.random.default_rng(random.getrandbits(64))
+    with get_stage_timer().stage("randomize", candidates=1):
+        approved = sample_base_parameters(
+            parameters, param_defs, BASE_TARGET_BOX, RENDER_OFFSET, rng)
+    if not approved and rejections is not None:
+        rejections[REJECTED_BASE_OUT_OF_BOUNDS] += 1
+    if verbose:
+        print("Approved!" if approved else "No root positions fit the base bounds.")
+    return approved
+
+def randomize_generation_parameters(
+        parameters:ParamSet,
+        param_defs:Dict[str, ParamDef],
+        rejections:Counter | None = None,
+        verbose:bool = True) -> bool:
+    return _randomize_until_approved(
+        parameters, param_defs, GENERATION_PARAM_NAMES, _evaluate_wing, rejections, verbose)
+
+def randomize_primary_vein_parameters(
+        parameters:ParamSet,
+        param_defs:Dict[str, ParamDef],
+        rejections:Counter | None = None,
+        verbose:bool = True) -> bool:
+    return _randomize_until_approved(
+        parameters, param_defs, PRIMARY_VEIN_PARAM_NAMES, _evaluate_primary_veins, rejections, verbose)
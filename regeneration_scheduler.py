@@ -0,0 +1,119 @@
+from collections import deque
+import threading
+import traceback
+from typing import Callable
+
+from param_set import ParamSet
+from vein_renderer import VeinRenderer
+from worker_pool import get_worker_pool
+
+# A job changes the wing's parameters or its renderer in place. It's given
+# copies that nothing else can see until the job is finished.
+Job = Callable[[VeinRenderer, ParamSet], object]
+
+class RegenerationScheduler:
+    """Runs wing regeneration on a background thread.
+
+    Requests are queued in order. A parameter update queued behind another
+    update is merged into it, and a job queued behind the same job replaces
+    it, so a burst of slider events costs one rebuild. Each job starts from
+    the result of the one before it and works on copies, so the wing on screen
+    is untouched until `poll` hands over a finished one. Results that later
+    requests have already superseded are never handed over."""
+
+    def __init__(self, vein_renderer:VeinRenderer, parameters:ParamSet):
+        self._renderer = vein_renderer
+        self._parameters = ParamSet(**parameters)
+        # Parameters as of the latest request, to work out what each update changes.
+        self._requested = dict(parameters)
+
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._num_requests = 0
+        self._num_finished = 0
+        self._result: tuple[VeinRenderer, ParamSet] | None = None
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="regeneration", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> bool:
+        """Whether a requested wing hasn't been handed over yet."""
+        with self._condition:
+            return self._num_finished < self._num_requests or self._result is not None
+
+    def request_update(self, parameters:ParamSet):
+        """Regenerate the wing for the current values of `parameters`."""
+        with self._condition:
+            changes = {
+                name: value for name, value in parameters.items()
+                if self._requested.get(name) != value}
+            if not changes:
+                return
+            self._requested.update(changes)
+            if self._queue and self._queue[-1][0] is None:
+                self._queue[-1][1].update(changes)
+            else:
+                self._queue.append((None, changes))
+            self._enqueued()
+
+    def request(self, job:Job):
+        """Run `job` on the wing, then bring the wing up to date with any
+        parameters it changed."""
+        with self._condition:
+            if self._queue and self._queue[-1][0] is job:
+                self._queue.pop()
+            self._queue.append((job, None))
+            self._enqueued()
+
+    def poll(self) -> tuple[VeinRenderer, ParamSet] | None:
+        """The finished renderer and its parameters, once every request made so
+        far has been handled."""
+        with self._condition:
+            result = self._result
+            self._result = None
+        if result is not None:
+            self._requested = dict(result[1])
+        return result
+
+    def shutdown(self):
+        with self._condition:
+            self._stopping = True
+            self._queue.clear()
+            self._condition.notify()
+        self._thread.join()
+
+    def _enqueued(self):
+        self._num_requests += 1
+        self._result = None
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                job, changes = self._queue.popleft()
+                num_requests = self._num_requests
+
+            renderer = self._renderer.copy()
+            parameters = ParamSet(**self._parameters)
+            try:
+                if changes is not None:
+                    parameters.update(changes)
+                else:
+                    job(renderer, parameters)
+                renderer.update(parameters, get_worker_pool())
+            except Exception:
+                # Keep the last good wing and carry on with the next request.
+                traceback.print_exc()
+                renderer, parameters = self._renderer, self._parameters
+            self._renderer, self._parameters = renderer, parameters
+
+            with self._condition:
+                if not self._queue:
+                    self._num_finished = num_requests
+                    if num_requests == self._num_requests:
+                        self._result = (renderer, ParamSet(**parameters))
@@ -1,30 +1,84 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 import glob
+import re
+import threading
+import traceback
 
 import pygame
 
+from png_writer import write_png
+from stage_timer import get_stage_timer
+
+# Captures queued but not yet written. Capturing blocks beyond this so held
+# down keys can't fill memory with surface copies.
+MAX_PENDING_WRITES = 8
+
 class ScreenCapturer:
-    def __init__(self, filename_prefix:str, filename_suffix:str):
+    """Saves numbered images on background writer threads."""
+
+    def __init__(self, filename_prefix:str, filename_suffix:str, max_workers:int = 1):
         self._prefix:str = filename_prefix
         self._suffix:str = filename_suffix
+        self._max_workers = max_workers
         self._index:int = self._get_index()
-    
-    def capture(self, surf:pygame.Surface) -> str:
-        index = self._index
-        self._index += 1
-
-        filename = self._get_filename(index)
-        pygame.image.save(surf, filename)
+        self._index_lock = threading.Lock()
+        self._writer: ThreadPoolExecutor | None = None
+        self._pending = threading.BoundedSemaphore(max(MAX_PENDING_WRITES, max_workers))
 
+    def capture(self, surf:pygame.Surface, copy:bool = True) -> str:
+        """Queue `surf` to be saved under the next filename and return it. Pass
+        `copy=False` for a surface nothing will draw on again."""
+        filename = self.next_filename()
+        self.write(surf, filename, copy)
         return filename
 
+    def write(self, surf:pygame.Surface, filename:str, copy:bool = True):
+        """Queue `surf` to be saved under `filename` rather than a numbered one."""
+        if copy:
+            surf = surf.copy()
+        self._pending.acquire()
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix="capture")
+        self._writer.submit(self._save, surf, filename).add_done_callback(_report_failure)
+
+    def next_filename(self) -> str:
+        """Claim the next unused filename, for output written some other way."""
+        with self._index_lock:
+            index = self._index
+            self._index += 1
+        return self._get_filename(index)
+
+    def flush(self):
+        """Wait until every queued capture has been written."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    def _save(self, surf:pygame.Surface, filename:str):
+        try:
+            with get_stage_timer().stage("capture"):
+                if filename.lower().endswith(".png"):
+                    write_png(filename, surf)
+                else:
+                    pygame.image.save(surf, filename)
+        finally:
+            self._pending.release()
+
     def _get_index(self) -> int:
-        existing = glob.glob(f"{self._prefix}*{self._suffix}")
-
-        # Counting down handles case where a screenshot in the middle has been deleted.
-        index = 999
-        while index >= 0 and self._get_filename(index) not in existing:
-            index -= 1
-        return index + 1
-    
+        # One past the highest number, so a screenshot deleted from the middle
+        # isn't overwritten by a later one.
+        pattern = re.compile(re.escape(self._prefix) + r"(\d+)" + re.escape(self._suffix) + "$")
+        indices = [
+            int(match.group(1)) for match in map(pattern.match, glob.glob(
+                f"{glob.escape(self._prefix)}*{glob.escape(self._suffix)}"))
+            if match is not None]
+        return max(indices, default=-1) + 1
+
     def _get_filename(self, index:int) -> str:
         return f"{self._prefix}{str(index).zfill(3)}{self._suffix}"
+
+def _report_failure(future:Future):
+    exception = future.exception()
+    if exception is not None:
+        traceback.print_exception(exception)
@@ -1,11 +1,11 @@
 
 from dataclasses import dataclass, field
-from pygame import Vector2
+import numpy as np
 
 @dataclass
 class Segment:
-    position:Vector2
-    direction:Vector2
+    position:np.ndarray
+    direction:np.ndarray
     length:float
     age: int = 0
     index: int = 0
@@ -0,0 +1,125 @@
+from collections import deque
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Durations kept per stage for the rolling percentiles.
+WINDOW = 200
+# Events kept for the trace file; the oldest are dropped first.
+MAX_EVENTS = 100_000
+
+class _Stage:
+    def __init__(self, timer:'StageTimer', name:str, counts:dict):
+        self._timer = timer
+        self._name = name
+        self._counts = counts
+        self._start = 0.0
+
+    def count(self, **counts):
+        """Attach counts, such as how many segments or cells were produced."""
+        self._counts.update(counts)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._timer.record(self._name, self._start, time.perf_counter() - self._start, self._counts)
+        return False
+
+class _NullStage:
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class StageTimer:
+    """Wall time and counts for each pipeline stage.
+
+    Stages are timed with `with timer.stage(name) as s: ...`. Nothing is
+    recorded while the timer is disabled, and `stage` then returns a shared
+    do-nothing context so instrumented code costs a single attribute check.
+    Recorded events can be written out in the Chrome trace event format,
+    which chrome://tracing and Perfetto open."""
+
+    def __init__(self):
+        self.enabled = False
+        self._durations: dict[str, deque] = {}
+        self._last_counts: dict[str, dict] = {}
+        self._events: deque = deque(maxlen=MAX_EVENTS)
+        self._lock = threading.Lock()
+
+    def stage(self, name:str, **counts):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, dict(counts))
+
+    def record(
+            self,
+            name:str,
+            start:float,
+            duration:float,
+            counts:dict | None = None,
+            tid:int | None = None):
+        """Record a stage timed elsewhere, for example in a worker process.
+        `start` is a `time.perf_counter` value."""
+        if not self.enabled:
+            return
+        counts = counts or {}
+        if tid is None:
+            tid = threading.get_ident()
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = deque(maxlen=WINDOW)
+            durations.append(duration)
+            self._last_counts[name] = counts
+            self._events.append((name, start, duration, tid, counts))
+
+    def summary(self) -> list[tuple[str, float, float, int, dict]]:
+        """Each stage's name, p50 and p99 in seconds over its recent runs, the
+        number of runs those cover and the counts of its latest run."""
+        with self._lock:
+            stages = [(name, np.array(d), self._last_counts[name])
+                      for name, d in self._durations.items()]
+        return [(name, float(np.percentile(d, 50)), float(np.percentile(d, 99)), len(d), counts)
+                for name, d, counts in stages]
+
+    def clear(self):
+        with self._lock:
+            self._durations.clear()
+            self._last_counts.clear()
+            self._events.clear()
+
+    def write_trace(self, filename:str) -> int:
+        """Write the recorded events as a Chrome trace and return how many."""
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        trace_events = [{
+            "name": name,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid,
+            "tid": tid,
+            "args": counts,
+        } for name, start, duration, tid, counts in events]
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+        return len(trace_events)
+
+_stage_timer = StageTimer()
+
+def get_stage_timer() -> StageTimer:
+    """The timer shared by everything in this process."""
+    return _stage_timer
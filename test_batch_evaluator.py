@@ -0,0 +1,120 @@
+"""Checks the vectorized constraints against the wing-at-a-time checks.
+
+    python -m pytest -q
+"""
+
+import itertools
+
+import numpy as np
+import pytest
+
+from batch_evaluator import CandidateBatch, draw_candidates, evaluate_candidates, \
+    evaluate_constraints
+from get_param_defs import get_param_defs
+from param_set import ParamSet
+from param_set_defaults import default_param_set
+from randomizer import GENERATION_PARAM_NAMES, PRIMARY_VEIN_PARAM_NAMES, check_wing
+from vein_grower import BOUNDS_CONSTRAINT, COLLISION_CONSTRAINT, LENGTH_CONSTRAINT, \
+    VeinGrower
+from vein_renderer import VeinRenderer
+from wing_bounds import BASE_TARGET_BOX, RENDER_OFFSET, TARGET_BOX
+
+BASE_PARAM_NAMES = [
+    f"root_segment_pos_{term}_{axis}"
+    for term in ("const", "linear", "quadratic") for axis in ("x", "y")]
+
+PARAM_GROUPS = {
+    "base": BASE_PARAM_NAMES,
+    "generation": GENERATION_PARAM_NAMES,
+    "primary": PRIMARY_VEIN_PARAM_NAMES,
+    "all": BASE_PARAM_NAMES + GENERATION_PARAM_NAMES + PRIMARY_VEIN_PARAM_NAMES,
+}
+
+BATCH_SIZE = 100
+
+def draw_batch(group:str, num_root_segments:int, seed:int) -> CandidateBatch:
+    parameters = default_param_set()
+    parameters["num_root_segments"] = num_root_segments
+    return draw_candidates(
+        parameters, get_param_defs(), PARAM_GROUPS[group], BATCH_SIZE,
+        np.random.default_rng(seed))
+
+def first_failure(
+        parameters:ParamSet,
+        check_length:bool,
+        check_tips:bool,
+        check_collisions:bool) -> str | None:
+    """What `evaluate_candidates` should find for one candidate, from `VeinGrower`."""
+    if check_tips:
+        failure = VeinGrower(
+            parameters, TARGET_BOX, RENDER_OFFSET, check_length, check_collisions).grow()
+        return failure.constraint if failure is not None else None
+    # Without the tips, the bounds only cover the roots.
+    if check_length and VeinGrower(parameters, check_collisions=False).grow() is not None:
+        return LENGTH_CONSTRAINT
+    if not VeinGrower(parameters, TARGET_BOX, RENDER_OFFSET).roots_contained():
+        return BOUNDS_CONSTRAINT
+    if check_collisions and VeinGrower(parameters, check_length=False).grow() is not None:
+        return COLLISION_CONSTRAINT
+    return None
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("num_root_segments", [5, 9, 14])
+@pytest.mark.parametrize("group", list(PARAM_GROUPS))
+def test_matches_check_wing(group:str, num_root_segments:int, seed:int):
+    batch = draw_batch(group, num_root_segments, seed)
+    constraints = evaluate_candidates(batch, TARGET_BOX, RENDER_OFFSET)
+    for k, constraint in enumerate(constraints):
+        failure = check_wing(batch.candidate(k))
+        assert constraint == (failure.constraint if failure is not None else None), \
+            f"candidate {k}"
+
+@pytest.mark.parametrize(
+    "check_length,check_tips,check_collisions",
+    list(itertools.product([True, False], repeat=3)))
+@pytest.mark.parametrize("group", ["primary", "all"])
+def test_checks_can_be_skipped(
+        group:str, check_length:bool, check_tips:bool, check_collisions:bool):
+    batch = draw_batch(group, 9, 0)
+    constraints = evaluate_candidates(
+        batch, TARGET_BOX, RENDER_OFFSET, check_length, check_tips, check_collisions)
+    for k, constraint in enumerate(constraints):
+        assert constraint == first_failure(
+            batch.candidate(k), check_length, check_tips, check_collisions), f"candidate {k}"
+
+def test_draws_reach_every_outcome():
+    # Candidates have to drop out at each stage for the remaining ones to be
+    # looked up by the right index.
+    seen = set()
+    for group in PARAM_GROUPS:
+        seen.update(evaluate_candidates(draw_batch(group, 9, 0), TARGET_BOX, RENDER_OFFSET))
+    assert seen == {LENGTH_CONSTRAINT, BOUNDS_CONSTRAINT, COLLISION_CONSTRAINT, None}
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("num_root_segments", [5, 9, 14])
+@pytest.mark.parametrize("group", list(PARAM_GROUPS))
+def test_constraints_match_vein_renderer(group:str, num_root_segments:int, seed:int):
+    batch = draw_batch(group, num_root_segments, seed)
+    constraints = evaluate_constraints(batch, TARGET_BOX, BASE_TARGET_BOX, RENDER_OFFSET)
+    for k in range(batch.size):
+        vein_renderer = VeinRenderer(batch.candidate(k))
+        expected = {
+            "is_base_contained_by": vein_renderer.is_base_contained_by(
+                BASE_TARGET_BOX, RENDER_OFFSET),
+            "is_contained_by": vein_renderer.is_contained_by(TARGET_BOX, RENDER_OFFSET),
+            "has_collision": vein_renderer.has_collision(),
+            "primary_vein_length_constraint": vein_renderer.primary_vein_length_constraint(),
+        }
+        for name, value in expected.items():
+            assert constraints[name][k] == value, f"{name} of candidate {k}"
+
+def test_constraint_draws_cover_both_outcomes():
+    # Otherwise a constraint could be wrong in a way the comparison never sees.
+    seen:dict[str, set[bool]] = {}
+    for group in PARAM_GROUPS:
+        batch = draw_batch(group, 9, 0)
+        constraints = evaluate_constraints(batch, TARGET_BOX, BASE_TARGET_BOX, RENDER_OFFSET)
+        for name, values in constraints.items():
+            seen.setdefault(name, set()).update(bool(value) for value in values)
+    for name, outcomes in seen.items():
+        assert outcomes == {True, False}, f"{name} only ever {outcomes}"
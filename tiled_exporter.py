@@ -0,0 +1,151 @@
+import json
+import os
+
+import numpy as np
+import pygame
+import shapely
+from shapely import STRtree
+
+from png_writer import PngWriter
+from vein_renderer import VeinRenderer
+
+VEIN_WIDTH = 3
+CROSS_VEIN_WIDTH = 1
+
+# Pixels rendered at a time. A PNG is written in full width strips of about
+# this many pixels, a tiled layout in square tiles of this many.
+TILE_PIXELS = 1024 * 1024
+
+class TiledExporter:
+    """Rasterizes a wing at any scale one tile at a time.
+
+    Vein and cross vein segments are put in an STR-tree once and each tile
+    only draws the segments whose bounds reach it, so peak memory is about
+    one tile however large the image. Every tile has the same pixels as that
+    part of the whole image drawn in one go, so tiles line up seamlessly."""
+
+    def __init__(
+            self,
+            vein_renderer:VeinRenderer,
+            size,
+            offset,
+            scale:float = 1.0,
+            background:tuple[int, int, int] = (0, 0, 0)):
+        self._width = round(size[0] * scale)
+        self._height = round(size[1] * scale)
+        self._background = background
+        offset = np.asarray(offset, dtype=float) * scale
+
+        alpha = vein_renderer.parameters["alpha"]
+        self._vein_color = pygame.Color(255, 255, 255, alpha)
+        self._cross_vein_color = pygame.Color(255, 255, 255)
+        self._vein_width = max(1, round(VEIN_WIDTH * scale))
+        self._cross_vein_width = max(1, round(CROSS_VEIN_WIDTH * scale))
+
+        left, right = vein_renderer.cross_vein_polylines()
+        veins = vein_renderer.vein_polylines()
+        cross_veins = _segments([offset + points * (-1, 1) * scale for points in left] +
+                                [offset + points * scale for points in right])
+        veins = _segments([offset + points * (h_flip, 1) * scale
+                           for h_flip in (-1, 1) for points in veins])
+
+        # Cross veins are drawn first, as render_to does.
+        self._segments = np.concatenate([cross_veins, veins])
+        self._is_vein = np.arange(len(self._segments)) >= len(cross_veins)
+        self._bounds = self._segment_bounds()
+        self._strtree = STRtree(shapely.box(*np.array(
+            [(b.left, b.top, b.right, b.bottom) for b in self._bounds]).reshape(-1, 4).T))
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self._width, self._height
+
+    def render_tile(self, rect:pygame.Rect) -> pygame.Surface:
+        """The part of the image covered by `rect`, on an opaque surface."""
+        wing = pygame.Surface(rect.size, pygame.SRCALPHA)
+        tile_box = shapely.box(rect.left, rect.top, rect.right, rect.bottom)
+        for i in np.sort(self._strtree.query(tile_box)):
+            if self._is_vein[i]:
+                color, width = self._vein_color, self._vein_width
+            else:
+                color, width = self._cross_vein_color, self._cross_vein_width
+            bounds = self._bounds[i]
+            if rect.contains(bounds):
+                start, end = self._segments[i] - rect.topleft
+                pygame.draw.line(wing, color, start, end, width)
+            else:
+                self._draw_clipped_line(wing, rect, i, bounds, color, width)
+
+        result = pygame.Surface(rect.size)
+        result.fill(self._background)
+        result.blit(wing)
+        return result
+
+    def write_png(self, filename:str):
+        """Write the whole image as one PNG, compressed strip by strip."""
+        strip_height = max(1, min(self._height, TILE_PIXELS // max(self._width, 1)))
+        with open(filename, 'wb') as f:
+            writer = PngWriter(f, self._width, self._height)
+            for top in range(0, self._height, strip_height):
+                rect = pygame.Rect(0, top, self._width, min(strip_height, self._height - top))
+                writer.write_rows(pygame.image.tobytes(self.render_tile(rect), "RGB"))
+            writer.finish()
+
+    def write_tiles(self, prefix:str, tile_size:int | None = None) -> str:
+        """Write the image as a grid of square PNG tiles, with a JSON manifest
+        describing the grid. Returns the manifest's filename."""
+        if tile_size is None:
+            tile_size = int(TILE_PIXELS ** 0.5)
+        columns = -(-self._width // tile_size)
+        rows = -(-self._height // tile_size)
+        tiles = []
+        for row in range(rows):
+            for column in range(columns):
+                rect = pygame.Rect(column * tile_size, row * tile_size, tile_size, tile_size)
+                rect = rect.clip(pygame.Rect(0, 0, self._width, self._height))
+                filename = f"{prefix}r{row:03d}_c{column:03d}.png"
+                pygame.image.save(self.render_tile(rect), filename)
+                tiles.append({
+                    "row": row,
+                    "column": column,
+                    "x": rect.x,
+                    "y": rect.y,
+                    "width": rect.width,
+                    "height": rect.height,
+                    "file": os.path.basename(filename),
+                })
+
+        manifest_filename = f"{prefix}tiles.json"
+        with open(manifest_filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                "width": self._width,
+                "height": self._height,
+                "tile_size": tile_size,
+                "rows": rows,
+                "columns": columns,
+                "tiles": tiles,
+            }, f, indent=2)
+        return manifest_filename
+
+    def _draw_clipped_line(self, wing, rect, i, bounds, color, width):
+        # pygame rasterizes a line differently once it's clipped to the edge of
+        # a surface, so a line crossing the tile edge is drawn whole on a
+        # scratch surface and only the pixels it sets are copied.
+        scratch = pygame.Surface(bounds.size)
+        scratch.set_colorkey((0, 0, 0))
+        start, end = self._segments[i] - bounds.topleft
+        pygame.draw.line(scratch, (255, 255, 255), start, end, width)
+        pygame.mask.from_surface(scratch).to_surface(
+            wing, setcolor=color, unsetcolor=None,
+            dest=(bounds.left - rect.left, bounds.top - rect.top))
+
+    def _segment_bounds(self) -> list[pygame.Rect]:
+        # Padded by half the stroke so every pixel a line sets is inside.
+        pad = np.where(self._is_vein, self._vein_width, self._cross_vein_width) / 2 + 1
+        lower = np.floor(self._segments.min(axis=1) - pad[:, None]).astype(int)
+        upper = np.ceil(self._segments.max(axis=1) + pad[:, None]).astype(int)
+        return [pygame.Rect(tuple(l), tuple(u - l)) for l, u in zip(lower, upper)]
+
+def _segments(polylines:list[np.ndarray]) -> np.ndarray:
+    segments = [np.stack([points[:-1], points[1:]], axis=1) for points in polylines]
+    return np.concatenate(segments) if segments else np.empty((0, 2, 2))
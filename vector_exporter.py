@@ -0,0 +1,148 @@
+from typing import Iterator, TextIO
+import zlib
+
+import numpy as np
+
+from vein_renderer import VeinRenderer
+
+VEIN_WIDTH = 3
+CROSS_VEIN_WIDTH = 1
+
+class VectorExporter:
+    """Writes a wing as vector paths without drawing it onto a surface.
+
+    Veins are written as one polyline each and cross veins as the merged
+    polylines of their unique cell edges, for both halves of the wing. Paths
+    are written as they're produced so memory use doesn't grow with the file.
+    Coordinates and colours match what `VeinRenderer.render_to` draws at the
+    same offset."""
+
+    def __init__(
+            self,
+            vein_renderer:VeinRenderer,
+            size,
+            offset,
+            background:tuple[int, int, int] | None = (0, 0, 0)):
+        self._vein_renderer = vein_renderer
+        self._size = tuple(size)
+        self._offset = np.asarray(offset, dtype=float)
+        self._background = background
+
+    def write_svg(self, filename:str):
+        width, height = self._size
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                f'viewBox="0 0 {width} {height}">\n')
+            if self._background is not None:
+                f.write(f'<rect width="100%" height="100%" fill="{_svg_color(self._background)}"/>\n')
+            f.write(
+                f'<g fill="none" stroke="#ffffff" stroke-width="{CROSS_VEIN_WIDTH}" '
+                'stroke-linejoin="round">\n')
+            for polyline in self._cross_vein_polylines():
+                _write_svg_path(f, polyline)
+            f.write(
+                f'</g>\n<g fill="none" stroke="#ffffff" stroke-width="{VEIN_WIDTH}" '
+                f'stroke-opacity="{self._vein_opacity():.4g}" stroke-linejoin="round">\n')
+            for polyline in self._vein_polylines():
+                _write_svg_path(f, polyline)
+            f.write('</g>\n</svg>\n')
+
+    def write_pdf(self, filename:str):
+        """Write a single page PDF, one point per pixel."""
+        width, height = self._size
+        with open(filename, 'wb') as f:
+            writer = _PdfWriter(f)
+            writer.write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+            writer.write_object(2, b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>")
+            writer.write_object(3, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                "/Contents 4 0 R /Resources << /ExtGState << /Veins 6 0 R >> >> >>").encode())
+
+            # The content stream's length isn't known until it's been written,
+            # so it's given afterwards as an object of its own.
+            writer.begin_object(4)
+            f.write(b"<< /Length 5 0 R /Filter /FlateDecode >>\nstream\n")
+            start = f.tell()
+            compressor = zlib.compressobj()
+
+            def emit(text:str):
+                f.write(compressor.compress(text.encode()))
+
+            # PDF's y axis points up.
+            emit(f"1 0 0 -1 0 {height} cm 1 J 1 j\n")
+            if self._background is not None:
+                emit(f"{_pdf_color(self._background)} rg 0 0 {width} {height} re f\n")
+            emit(f"1 1 1 RG {CROSS_VEIN_WIDTH} w\n")
+            for polyline in self._cross_vein_polylines():
+                emit(_pdf_path(polyline))
+            emit(f"/Veins gs {VEIN_WIDTH} w\n")
+            for polyline in self._vein_polylines():
+                emit(_pdf_path(polyline))
+            f.write(compressor.flush())
+            length = f.tell() - start
+            f.write(b"\nendstream\nendobj\n")
+
+            writer.write_object(5, str(length).encode())
+            writer.write_object(6, f"<< /CA {self._vein_opacity():.4g} >>".encode())
+            writer.finish(root=1)
+
+    def _vein_opacity(self) -> float:
+        return float(self._vein_renderer.parameters["alpha"]) / 255
+
+    def _transform(self, points:np.ndarray, h_flip:int) -> np.ndarray:
+        return self._offset + points * (h_flip, 1)
+
+    def _vein_polylines(self) -> Iterator[np.ndarray]:
+        for h_flip in (-1, 1):
+            for points in self._vein_renderer.vein_polylines():
+                yield self._transform(points, h_flip)
+
+    def _cross_vein_polylines(self) -> Iterator[np.ndarray]:
+        left, right = self._vein_renderer.cross_vein_polylines()
+        for h_flip, polylines in ((-1, left), (1, right)):
+            for points in polylines:
+                yield self._transform(points, h_flip)
+
+class _PdfWriter:
+    """Just enough of the PDF file structure to write objects in order and
+    index them."""
+
+    def __init__(self, f):
+        self._f = f
+        self._offsets: dict[int, int] = {}
+        f.write(b"%PDF-1.4\n")
+
+    def begin_object(self, number:int):
+        self._offsets[number] = self._f.tell()
+        self._f.write(f"{number} 0 obj\n".encode())
+
+    def write_object(self, number:int, body:bytes):
+        self.begin_object(number)
+        self._f.write(body + b"\nendobj\n")
+
+    def finish(self, root:int):
+        xref = self._f.tell()
+        count = max(self._offsets) + 1
+        self._f.write(f"xref\n0 {count}\n0000000000 65535 f \n".encode())
+        for number in range(1, count):
+            self._f.write(f"{self._offsets[number]:010d} 00000 n \n".encode())
+        self._f.write(
+            f"trailer\n<< /Size {count} /Root {root} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+def _svg_color(color) -> str:
+    return "#" + "".join(f"{int(c):02x}" for c in color)
+
+def _pdf_color(color) -> str:
+    return " ".join(f"{c / 255:.4g}" for c in color)
+
+def _write_svg_path(f:TextIO, points:np.ndarray):
+    coords = " ".join(f"{x:.2f},{y:.2f}" for x, y in points)
+    f.write(f'<path d="M{coords}"/>\n')
+
+def _pdf_path(points:np.ndarray) -> str:
+    ops = [f"{points[0, 0]:.2f} {points[0, 1]:.2f} m"]
+    ops.extend(f"{x:.2f} {y:.2f} l" for x, y in points[1:])
+    ops.append("S\n")
+    return "\n".join(ops)
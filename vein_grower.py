@@ -0,0 +1,201 @@
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+from shapely import STRtree, contains_xy
+
+from collision_detector import is_adjacent, segment_intersections
+from param_set import ParamSet
+from vein_tree import VeinTree, num_generations, quadratic_param_to_array, segment_directions
+from wing_bounds import BoundsRect, bounds_polygon
+
+LENGTH_CONSTRAINT = "primary_vein_length"
+BOUNDS_CONSTRAINT = "bounds"
+COLLISION_CONSTRAINT = "collision"
+
+@dataclass
+class GrowthFailure:
+    constraint: str
+    generation: int
+
+class VeinGrower:
+    """Grows all primary veins together, generation by generation.
+
+    Constraints are checked as generations are added so a candidate wing can
+    be abandoned at its first violation instead of after the whole tree has
+    been built. The checks match `VeinRenderer`: every vein must have at least
+    one child, the roots and tip endpoints must lie inside the bounds, and no
+    two non-adjacent segments may cross."""
+
+    def __init__(
+            self,
+            parameters:ParamSet,
+            bounds_rect:BoundsRect | None = None,
+            offset=(0, 0),
+            check_length:bool = True,
+            check_collisions:bool = True):
+        self._parameters = parameters
+        self._bounds = bounds_polygon(bounds_rect, offset) if bounds_rect is not None else None
+        self._check_length = check_length
+        self._check_collisions = check_collisions
+
+        num_veins = int(parameters['num_root_segments'])
+        self._vein_index = np.arange(1, num_veins + 1)
+        self._counts = num_generations(parameters, self._vein_index)
+        self._max_count = int(self._counts.max()) if num_veins > 0 else 0
+        total = int(self._counts.sum())
+
+        self._direction_grid: np.ndarray | None = None
+        self._length_grid: np.ndarray | None = None
+
+        # Segments are stored in the order they're grown: by generation, then vein.
+        self._positions = np.empty((total, 2))
+        self._directions = np.empty((total, 2))
+        self._lengths = np.empty(total)
+        self._vectors = np.empty((total, 2))
+        self._indices = np.empty(total, dtype=int)
+        self._generations = np.empty(total, dtype=int)
+        self._boxes = np.empty(total, dtype=object)
+        self._num_segments = 0
+
+        self._generation = 0
+        self._frontier = quadratic_param_to_array(parameters, 'root_segment_pos', self._vein_index)
+
+    @property
+    def generation(self) -> int:
+        """The next generation to be grown."""
+        return self._generation
+
+    @property
+    def done(self) -> bool:
+        return self._generation >= self._max_count
+
+    def roots_contained(self) -> bool:
+        if self._bounds is None:
+            return True
+        roots = quadratic_param_to_array(self._parameters, 'root_segment_pos', self._vein_index)
+        return bool(np.all(contains_xy(self._bounds, roots)))
+
+    def grow(self) -> GrowthFailure | None:
+        """Grow the remaining generations and return the first violation found.
+
+        Length, roots and tips are checked before anything is grown. The rest
+        of the veins are then grown in one go and tested for crossings with a
+        single STR-tree, reporting the earliest generation that collides."""
+        return self.step(self._max_count - self._generation)
+
+    def step(self, num_generations:int = 1) -> GrowthFailure | None:
+        """Add the next generations to every vein that reaches them.
+
+        Returns the earliest violation among the added generations, or None if
+        there is none or every generation has already been grown. The first
+        step also checks vein length, the roots and every vein's tip."""
+        start_generation = self._generation
+        if start_generation == 0:
+            if self._check_length and np.any(self._counts < 2):
+                return GrowthFailure(LENGTH_CONSTRAINT, 0)
+            if not self.roots_contained():
+                return GrowthFailure(BOUNDS_CONSTRAINT, 0)
+
+            # Directions and lengths don't depend on where the veins have got
+            # to, so they're evaluated for every generation at once.
+            generation = np.arange(self._max_count)
+            self._direction_grid = segment_directions(
+                self._parameters, self._vein_index[:, None], generation[None, :])
+            lengths = np.full(self._max_count, float(self._parameters['segment_len_factor']))
+            lengths[:1] = self._parameters['root_segment_len']
+            self._length_grid = np.cumprod(lengths)
+
+            tip_generation = self._first_tip_outside()
+            if tip_generation is not None:
+                return GrowthFailure(BOUNDS_CONSTRAINT, tip_generation)
+        if self.done:
+            return None
+        assert self._direction_grid is not None and self._length_grid is not None
+
+        end_generation = min(start_generation + num_generations, self._max_count)
+        generation = np.arange(start_generation, end_generation)
+        directions = self._direction_grid[:, start_generation:end_generation]
+        vectors = directions * self._length_grid[None, start_generation:end_generation, None]
+
+        # Continue each vein's running sum from where its last segment ended.
+        positions = np.empty_like(vectors)
+        positions[:, :1] = self._frontier[:, None, :]
+        positions[:, 1:] = vectors[:, :-1]
+        np.cumsum(positions, axis=1, out=positions)
+        endpoints = positions + vectors
+        self._frontier = endpoints[:, -1]
+
+        # Transposed so the new segments are ordered by generation, then vein.
+        active = (generation[None, :] < self._counts[:, None]).T
+        start = self._num_segments
+        end = start + int(active.sum())
+        self._positions[start:end] = positions.transpose(1, 0, 2)[active]
+        self._directions[start:end] = directions.transpose(1, 0, 2)[active]
+        self._vectors[start:end] = vectors.transpose(1, 0, 2)[active]
+        self._lengths[start:end] = np.broadcast_to(
+            self._length_grid[start_generation:end_generation, None], active.shape)[active]
+        self._indices[start:end] = np.broadcast_to(self._vein_index, active.shape)[active]
+        self._generations[start:end] = np.broadcast_to(generation[:, None], active.shape)[active]
+        self._num_segments = end
+        self._generation = end_generation
+
+        if self._check_collisions:
+            collision_generation = self._first_collision_generation(start, end)
+            if collision_generation is not None:
+                return GrowthFailure(COLLISION_CONSTRAINT, collision_generation)
+        return None
+
+    def tree(self) -> VeinTree:
+        """The grown veins, laid out as `VeinTree.from_parameters` would."""
+        n = self._num_segments
+        order = np.lexsort((self._generations[:n], self._indices[:n]))
+        grown = np.bincount(self._indices[:n] - 1, minlength=len(self._vein_index))
+        vein_offsets = np.zeros(len(self._vein_index) + 1, dtype=int)
+        np.cumsum(grown, out=vein_offsets[1:])
+        return VeinTree(
+            positions=self._positions[:n][order],
+            directions=self._directions[:n][order],
+            lengths=self._lengths[:n][order],
+            indices=self._indices[:n][order],
+            generations=self._generations[:n][order],
+            vein_offsets=vein_offsets)
+
+    def _first_tip_outside(self) -> int | None:
+        """The earliest generation at which a vein's tip lies outside the bounds."""
+        if self._bounds is None or self._max_count == 0:
+            return None
+        assert self._direction_grid is not None and self._length_grid is not None
+        # Summed in the same order as the veins are grown, so the tips match.
+        steps = np.empty((len(self._vein_index), self._max_count + 1, 2))
+        steps[:, 0] = self._frontier
+        steps[:, 1:] = self._direction_grid * self._length_grid[None, :, None]
+        np.cumsum(steps, axis=1, out=steps)
+        grown = self._counts > 0
+        tips = steps[grown, self._counts[grown]]
+        outside = ~contains_xy(self._bounds, tips)
+        if not np.any(outside):
+            return None
+        return int((self._counts[grown][outside] - 1).min())
+
+    def _first_collision_generation(self, start:int, end:int) -> int | None:
+        # New segments are tested against everything grown before them,
+        # including earlier veins of the same generation. Only pairs whose
+        # bounding boxes overlap reach the exact test.
+        endpoints = self._positions[start:end] + self._vectors[start:end]
+        lower = np.minimum(self._positions[start:end], endpoints)
+        upper = np.maximum(self._positions[start:end], endpoints)
+        self._boxes[start:end] = shapely.box(lower[:, 0], lower[:, 1], upper[:, 0], upper[:, 1])
+        new, old = STRtree(self._boxes[:end]).query(self._boxes[start:end])
+        new += start
+
+        keep = (old < new) & ~is_adjacent(
+            self._indices[new], self._generations[new],
+            self._indices[old], self._generations[old])
+        new, old = new[keep], old[keep]
+        hit, _ = segment_intersections(
+            self._positions[new], self._vectors[new],
+            self._positions[old], self._vectors[old])
+        if not np.any(hit):
+            return None
+        return int(self._generations[new[hit]].min())
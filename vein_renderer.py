@@ -1,195 +1,342 @@
+from concurrent.futures import Executor
+import copy
+from typing import TYPE_CHECKING
+
 import numpy as np
-import pygame
-from shapely.geometry import Point, Polygon
+from shapely import contains_xy
 
+from collision_detector import CollisionDetector
 from interveinal_region_renderer import InterveinalRegionRenderer
 from param_set import ParamSet
-from param_helpers import quadratic_param_to_vector2, param_to_vector2
-from segment import Segment
-from subdict import subdict
+from polygon_edges import merged_edges
+from pipeline_stages import SEEDING, VEIN_GROWTH, changed_parameters, invalidated_stages
+from stage_timer import get_stage_timer
+from vein_tree import VeinTree
+from wing_cache import WingCache, region_key, vein_key
+from wing_bounds import BoundsRect, bounds_polygon
+
+# Only drawing needs pygame, so it's imported when a wing is first drawn and
+# worker processes that just build geometry never load it.
+if TYPE_CHECKING:
+    import pygame
 
 class VeinRenderer:
-    def __init__(self, parameters:ParamSet):
+    def __init__(self, parameters:ParamSet, cache:WingCache | None = None):
         self._parameters = parameters
-        self._root_segments = self._generate_segments(parameters)
-        self._tip_segments = self._get_tip_segments(self._root_segments)
+        self._cache = cache
+        self._parameter_values = dict(parameters)
+        self._vein_tree = self._generate_segments(parameters)
         self._left_interveinal_regions: list[InterveinalRegionRenderer] = []
         self._right_interveinal_regions: list[InterveinalRegionRenderer]= []
+        self._vein_polylines = self._build_vein_polylines()
+        self._cross_vein_polylines: tuple[list[np.ndarray], list[np.ndarray]] = ([], [])
+        self._screen_lines: _ScreenLines | None = None
+        self._surface: 'pygame.Surface | None' = None
+        self._surface_offset = None
+        self._surface_dirty = True
+
+    def copy(self) -> 'VeinRenderer':
+        """A renderer for the same wing that can be updated without affecting
+        this one. The tree and regions are never modified so they're shared;
+        the copy draws onto a surface of its own."""
+        result = copy.copy(self)
+        result._left_interveinal_regions = list(self._left_interveinal_regions)
+        result._right_interveinal_regions = list(self._right_interveinal_regions)
+        result._surface = None
+        result._surface_offset = None
+        result._surface_dirty = True
+        return result
 
     def primary_vein_length_constraint(self):
-        for root_segment in self._root_segments:
-            if len(root_segment.children) < 1:
-                return False
-        return True
-
-    def is_base_contained_by(self, bounds_rect:pygame.Rect, offset):
-        bounds:Polygon = Polygon([
-            np.subtract(bounds_rect.topleft, offset),
-            np.subtract(bounds_rect.topright, offset),
-            np.subtract(bounds_rect.bottomright, offset),
-            np.subtract(bounds_rect.bottomleft, offset)])
-
-        for root_segment in self._root_segments:
-            if not bounds.contains(Point(root_segment.position)):
-                return False
-
-        return True
-
-    def is_contained_by(self, bounds_rect:pygame.Rect, offset):
-        bounds:Polygon = Polygon([
-            np.subtract(bounds_rect.topleft, offset),
-            np.subtract(bounds_rect.topright, offset),
-            np.subtract(bounds_rect.bottomright, offset),
-            np.subtract(bounds_rect.bottomleft, offset)])
+        return bool(np.all(self._vein_tree.vein_lengths() > 1))
 
-        for root_segment in self._root_segments:
-            if not bounds.contains(Point(root_segment.position)):
-                return False
+    def is_base_contained_by(self, bounds_rect:BoundsRect, offset):
+        with get_stage_timer().stage("containment", veins=self._vein_tree.num_veins):
+            bounds = bounds_polygon(bounds_rect, offset)
+            return bool(np.all(contains_xy(bounds, self._vein_tree.root_positions)))
 
-        for tip_segment in self._tip_segments:
-            if not bounds.contains(Point(self._get_endpoint(tip_segment))):
-                return False
-
-        return True
+    def is_contained_by(self, bounds_rect:BoundsRect, offset):
+        with get_stage_timer().stage("containment", veins=self._vein_tree.num_veins):
+            bounds = bounds_polygon(bounds_rect, offset)
+            tree = self._vein_tree
+            return bool(np.all(contains_xy(bounds, tree.root_positions))) and \
+                bool(np.all(contains_xy(bounds, tree.tip_endpoints)))
 
     def has_collision(self):
-        return bool(self._detect_collision(self._root_segments))
-
-    def generate_cross_veins(self):
-        self._left_interveinal_regions = self._get_interveinal_regions(
-            self._root_segments, self._parameters)
-        self._right_interveinal_regions = self._get_interveinal_regions(
-            self._root_segments, self._parameters)
-
-    def _get_segment_direction(self, parameters:ParamSet, index:int, generation:int):
-        return (
-            param_to_vector2(parameters, 'root_segment_dir_quadratic') * pow(index, 2) + \
-            param_to_vector2(parameters, 'root_segment_dir_linear') * index + \
-            param_to_vector2(parameters, 'root_segment_dir_const') + \
-            param_to_vector2(parameters, 'segment_dir_quadratic') * pow(generation, 2) + \
-            param_to_vector2(parameters, 'segment_dir_linear') * generation + \
-            param_to_vector2(parameters, 'segment_dir_a') * pow(index, 2) * pow(generation, 2) + \
-            param_to_vector2(parameters, 'segment_dir_b') * pow(index, 2) * generation + \
-            param_to_vector2(parameters, 'segment_dir_c') * index * pow(generation, 2) + \
-            param_to_vector2(parameters, 'segment_dir_d') * index * generation
-          ).normalize()
-
-    def _generate_segment_and_descendants(self, parameters:ParamSet, parent_segment:Segment):
-        index = parent_segment.index
-        p = subdict(parameters, 'max_generations')
-        max_generations = p['quadratic'] * pow(index, 2) + p['linear'] * index + p['const']
-
-        if parent_segment.generation < max_generations:
-            generation = parent_segment.generation + 1
-            child_segment = Segment(
-                position=parent_segment.position + parent_segment.direction * parent_segment.length,
-                direction=self._get_segment_direction(parameters, index, generation),
-                length=parent_segment.length * parameters['segment_len_factor'],
-                index=index,
-                generation=generation
-            )
-            parent_segment.children.append(child_segment)
-            self._generate_segment_and_descendants(parameters, child_segment)
-
-    def _generate_segments(self, parameters:ParamSet):
-        result = []
-
-        p = subdict(parameters, 'root_segment')
-
-        for zero_index in range(0, parameters['num_root_segments']):
-            one_index = zero_index + 1
-            root_segment = Segment(
-                position=quadratic_param_to_vector2(subdict(p, 'pos'), one_index),
-                direction=quadratic_param_to_vector2(subdict(p, 'dir'), one_index).normalize(),
-                length=p['len'],
-                index=one_index)
-            self._generate_segment_and_descendants(parameters, root_segment)
-            result.append(root_segment)
-
-        return result
-
-    def _get_tip_segments(self, root_segments:list[Segment]):
-        result = []
-        for segment in root_segments:
-            while len(segment.children) > 0:
-                segment = segment.children[0]
-            result.append(segment)
-        return result
-
-    def _intersection(self, seg0:Segment, seg1:Segment):
-        p0:pygame.Vector2 = seg0.position
-        p2:pygame.Vector2 = seg1.position
-        s1:pygame.Vector2 = seg0.direction * seg0.length
-        s2:pygame.Vector2 = seg1.direction * seg1.length
-
-        denominator:float = -s2.x * s1.y + s1.x * s2.y
-        if denominator == 0:
-            return False
-
-        s:float = (-s1.y * (p0.x - p2.x) + s1.x * (p0.y - p2.y)) / denominator
-        t:float = ( s2.x * (p0.y - p2.y) - s2.y * (p0.x - p2.x)) / denominator
-
-        if s > 0 and s < 1 and t > 0 and t < 1:
-            return pygame.Vector2(p0.x + t * s1.x, p0.y + t * s1.y)
-
-        return False
-
-    def _detect_collision(self, frontier:list[Segment], accumulator=False):
-        if not accumulator:
-            accumulator = []
-
-        # Breadth-first search will find collisions sooner.
-        next_frontier = []
-        for frontier_segment in frontier:
-            for segment in accumulator:
-                if frontier_segment.index == segment.index and \
-                        abs(frontier_segment.generation - segment.generation) < 2:
-                    # Ignore adjacent segments.
-                    continue
-
-                x = self._intersection(frontier_segment, segment)
-                if x:
-                    return x
-            accumulator.append(frontier_segment)
-            for child_segment in frontier_segment.children:
-                next_frontier.append(child_segment)
-
-        if len(next_frontier) > 0:
-            return self._detect_collision(next_frontier, accumulator)
-        return False
-
-    def _get_interveinal_regions(
+        return self._detect_collision() is not None
+
+    def generate_cross_veins(self, executor:Executor | None = None):
+        """Relax the interveinal regions of both wing halves.
+
+        Regions only depend on their two bounding veins and their own random
+        stream, seeded from the `cross_vein_seed` parameter, side and region
+        number. With an executor every region of both halves is built
+        concurrently from the vein coordinates, without one they're built one
+        after another, and the cells come out the same either way."""
+        num_regions = max(self._vein_tree.num_veins - 1, 0)
+        regions = self._build_regions(list(range(num_regions)), executor)
+        self._left_interveinal_regions = regions[:num_regions]
+        self._right_interveinal_regions = regions[num_regions:]
+        self._cross_vein_polylines = self._build_cross_vein_polylines()
+        self._screen_lines = None
+        self.invalidate()
+
+    def update(
             self,
-            root_segments: list[Segment],
-            parameters:ParamSet) -> list[InterveinalRegionRenderer]:
+            parameters:ParamSet,
+            executor:Executor | None = None,
+            warm_start:bool = False) -> list[str]:
+        """Bring the wing up to date with `parameters` and return the stages
+        that had to run again.
+
+        Only the stages fed by the parameters that changed are recomputed.
+        Veins the change doesn't reach are kept, and once cross veins have
+        been generated, only the regions beside a changed vein are relaxed
+        again, or every region when the cross vein density changed.
+
+        With `warm_start`, regions are relaxed again from the centers they
+        had, so the cells follow a wing changing a little at a time. They
+        then depend on the wings before this one, so they aren't cached."""
+        changed = changed_parameters(self._parameter_values, parameters)
+        stages = invalidated_stages(changed)
+        self._parameters = parameters
+        self._parameter_values = dict(parameters)
+        if not stages:
+            return stages
+
+        old_num_regions = len(self._left_interveinal_regions)
+        if VEIN_GROWTH in stages:
+            with get_stage_timer().stage("generation") as timing:
+                tree = self._cached_tree(parameters)
+                if tree is None:
+                    tree, changed_veins = self._vein_tree.updated(parameters, changed)
+                    self._cache_tree(parameters, tree)
+                else:
+                    changed_veins = tree.changed_veins(self._vein_tree)
+                self._vein_tree = tree
+                self._vein_polylines = self._build_vein_polylines()
+                timing.count(
+                    segments=len(tree.positions),
+                    changed_veins=int(np.count_nonzero(changed_veins)))
+            stale = changed_veins[:-1] | changed_veins[1:]
+            stale[old_num_regions:] = True
+        elif SEEDING in stages:
+            stale = np.ones(max(self._vein_tree.num_veins - 1, 0), dtype=bool)
+        else:
+            stale = np.zeros(old_num_regions, dtype=bool)
+
+        if old_num_regions > 0:
+            num_regions = len(stale)
+            left = self._left_interveinal_regions[:num_regions]
+            right = self._right_interveinal_regions[:num_regions]
+            stale_regions = [int(i) for i in np.nonzero(stale)[0]]
+            initial_centers = None
+            if warm_start:
+                initial_centers = [
+                    half[i].centers if i < len(half) else None
+                    for half in (left, right) for i in stale_regions]
+            regions = self._build_regions(stale_regions, executor, initial_centers)
+            for i, left_region, right_region in zip(
+                    stale_regions, regions[:len(stale_regions)], regions[len(stale_regions):]):
+                if i < len(left):
+                    left[i], right[i] = left_region, right_region
+                else:
+                    left.append(left_region)
+                    right.append(right_region)
+            self._left_interveinal_regions = left
+            self._right_interveinal_regions = right
+            self._cross_vein_polylines = self._build_cross_vein_polylines()
+
+        self._screen_lines = None
+        self.invalidate()
+        return stages
+
+    def invalidate(self):
+        """Mark the cached wing surface for redrawing on its next use."""
+        self._surface_dirty = True
+
+    def get_surface(self, size, offset) -> 'pygame.Surface':
+        """Return the wing pre-rendered onto a transparent surface.
+
+        The wing is only redrawn after `invalidate` or when the size or offset
+        changes, so blitting the result every frame costs the same however
+        complex the wing is."""
+        import pygame
+        size = tuple(size)
+        offset = tuple(offset)
+        if self._surface is None or self._surface.get_size() != size:
+            self._surface = pygame.Surface(size, pygame.SRCALPHA)
+            if pygame.display.get_surface() is not None:
+                self._surface = self._surface.convert_alpha()
+            self._surface_dirty = True
+        if self._surface_offset != offset:
+            self._surface_offset = offset
+            self._surface_dirty = True
+
+        if self._surface_dirty:
+            with get_stage_timer().stage("render", segments=len(self._vein_tree.positions)):
+                self._surface.fill((0, 0, 0, 0))
+                self.render_to(self._surface, offset)
+            self._surface_dirty = False
+        return self._surface
+
+    @property
+    def parameters(self) -> ParamSet:
+        return self._parameters
+
+    @property
+    def vein_tree(self) -> VeinTree:
+        """The primary veins, for the right half. Never modified, so it's safe
+        to share."""
+        return self._vein_tree
+
+    def vein_polylines(self) -> list[np.ndarray]:
+        """Each primary vein as the points of one polyline, for the right half."""
+        return list(self._vein_polylines)
+
+    def cross_vein_polylines(self) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        """The cell edges of the left and right halves, each shared edge once,
+        joined into polylines. Both are in right-half coordinates."""
+        left, right = self._cross_vein_polylines
+        return list(left), list(right)
+
+    @property
+    def has_cross_veins(self) -> bool:
+        return len(self._left_interveinal_regions) > 0
+
+    @property
+    def interveinal_regions(self) -> tuple[
+            list[InterveinalRegionRenderer], list[InterveinalRegionRenderer]]:
+        """The regions of the left and right halves, in right-half coordinates."""
+        return list(self._left_interveinal_regions), list(self._right_interveinal_regions)
+
+    def get_relaxation_stats(self) -> list[tuple[str, int, int, float]]:
+        """Side, region number, Lloyd iterations used and final displacement."""
         result = []
-        prev_segment:Segment | None = None
-        for segment in root_segments:
-            if prev_segment is not None:
-                result.append(InterveinalRegionRenderer(prev_segment, segment, parameters))
-            prev_segment = segment
+        for side, regions in [
+                ("left", self._left_interveinal_regions),
+                ("right", self._right_interveinal_regions)]:
+            for i, region in enumerate(regions):
+                result.append((side, i, region.lloyd_iterations, region.lloyd_displacement))
         return result
 
-    def _render_segment_and_descendants(self, surf, offset, h_flip, index, seg):
-        color = pygame.Color(255, 255, 255, self._parameters["alpha"])
-        point = np.add(offset, np.multiply([h_flip, 1], seg.position))
-        endpoint = np.add(offset, np.multiply([h_flip, 1], self._get_endpoint(seg)))
-        pygame.draw.line(surf, color, point, endpoint, 3)
-
-        for child_segment in seg.children:
-            self._render_segment_and_descendants(surf, offset, h_flip, index, child_segment)
+    def _build_regions(
+            self,
+            region_numbers:list[int],
+            executor:Executor | None,
+            initial_centers:list[np.ndarray | None] | None = None) -> list[InterveinalRegionRenderer]:
+        """The numbered regions of the left half followed by the same regions
+        of the right half. Regions found in the cache aren't relaxed again.
+        Regions warm started from `initial_centers`, given in the same order,
+        are always relaxed and never cached."""
+        vein_points = [self._vein_tree.vein_points(v) for v in range(self._vein_tree.num_veins)]
+        points0 = [vein_points[i] for i in region_numbers] * 2
+        points1 = [vein_points[i + 1] for i in region_numbers] * 2
+        sides = ["left"] * len(region_numbers) + ["right"] * len(region_numbers)
+        numbers = region_numbers * 2
+
+        regions: list[InterveinalRegionRenderer | None] = [None] * len(points0)
+        keys: list[str] = []
+        cache = self._cache if initial_centers is None else None
+        if initial_centers is None:
+            initial_centers = [None] * len(points0)
+        if cache is not None:
+            for j, side in enumerate(sides):
+                keys.append(region_key(
+                    points0[j], points1[j], self._parameters, side, numbers[j]))
+                arrays = cache.get(keys[j])
+                if arrays is not None:
+                    regions[j] = InterveinalRegionRenderer.from_arrays(
+                        points0[j], points1[j], self._parameters, side, numbers[j], arrays)
+
+        missing = [j for j, region in enumerate(regions) if region is None]
+        missing0 = [points0[j] for j in missing]
+        missing1 = [points1[j] for j in missing]
+        parameters = [self._parameters] * len(missing)
+        missing_sides = [sides[j] for j in missing]
+        missing_numbers = [numbers[j] for j in missing]
+        missing_centers = [initial_centers[j] for j in missing]
+        args = (missing0, missing1, parameters, missing_sides, missing_numbers, missing_centers)
+        if executor is None:
+            built = list(map(InterveinalRegionRenderer, *args))
+        else:
+            built = list(executor.map(InterveinalRegionRenderer, *args))
+
+        timer = get_stage_timer()
+        for j, region in zip(missing, built):
+            regions[j] = region
+            for name, start, duration, counts in region.stage_timings:
+                timer.record(name, start, duration, counts, tid=counts.get("pid"))
+            if cache is not None:
+                cache.put(keys[j], region.to_arrays())
+        return regions # type: ignore[return-value]
+
+    def _build_vein_polylines(self) -> list[np.ndarray]:
+        return [self._vein_tree.vein_points(v) for v in range(self._vein_tree.num_veins)]
+
+    def _build_cross_vein_polylines(self) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        return tuple( # type: ignore[return-value]
+            merged_edges([cell for region in regions for cell in region.voronoi_polygons])
+            for regions in (self._left_interveinal_regions, self._right_interveinal_regions))
+
+    def _get_screen_lines(self, offset) -> '_ScreenLines':
+        offset = tuple(offset)
+        if self._screen_lines is None or self._screen_lines.offset != offset:
+            left, right = self._cross_vein_polylines
+            self._screen_lines = _ScreenLines(
+                offset,
+                _to_screen(left, offset, -1) + _to_screen(right, offset, 1),
+                _to_screen(self._vein_polylines, offset, -1) +
+                    _to_screen(self._vein_polylines, offset, 1))
+        return self._screen_lines
+
+    def _generate_segments(self, parameters:ParamSet) -> VeinTree:
+        with get_stage_timer().stage("generation") as timing:
+            tree = self._cached_tree(parameters)
+            if tree is None:
+                tree = VeinTree.from_parameters(parameters)
+                self._cache_tree(parameters, tree)
+            timing.count(segments=len(tree.positions))
+        return tree
+
+    def _cached_tree(self, parameters:ParamSet) -> VeinTree | None:
+        if self._cache is None:
+            return None
+        arrays = self._cache.get(vein_key(parameters))
+        return VeinTree(**arrays) if arrays is not None else None
+
+    def _cache_tree(self, parameters:ParamSet, tree:VeinTree):
+        if self._cache is not None:
+            self._cache.put(vein_key(parameters), tree.to_arrays())
+
+    def _detect_collision(self):
+        with get_stage_timer().stage("collision", segments=len(self._vein_tree.positions)):
+            return CollisionDetector(self._vein_tree).first_collision()
 
     def render_to(self, surf, offset):
-        for interveinal_region in self._left_interveinal_regions:
-            interveinal_region.render_to(surf, offset, -1)
-
-        for interveinal_region in self._right_interveinal_regions:
-            interveinal_region.render_to(surf, offset, 1)
-
-        for index, root_segment in enumerate(self._root_segments):
-            self._render_segment_and_descendants(surf, offset, -1, index, root_segment)
-            self._render_segment_and_descendants(surf, offset, 1, index, root_segment)
-
-    # TODO: De-duplicate with interveinal_region_renderer.py
-    def _get_endpoint(self, segment:Segment):
-        return segment.position + segment.direction * segment.length
+        import pygame
+        lines = self._get_screen_lines(offset)
+        cross_vein_color = pygame.Color(255, 255, 255)
+        for points in lines.cross_veins:
+            pygame.draw.lines(surf, cross_vein_color, False, points)
+
+        vein_color = pygame.Color(255, 255, 255, self._parameters["alpha"])
+        for points in lines.veins:
+            pygame.draw.lines(surf, vein_color, False, points, 3)
+
+class _ScreenLines:
+    """Polylines already mirrored and moved to where they're drawn, as lists
+    of point tuples pygame can use directly."""
+
+    def __init__(self, offset, cross_veins:list[list], veins:list[list]):
+        self.offset = offset
+        self.cross_veins = cross_veins
+        self.veins = veins
+
+def _to_screen(polylines:list[np.ndarray], offset, h_flip:int) -> list[list]:
+    # All the polylines are transformed in one go and then split up again.
+    if not polylines:
+        return []
+    bounds = np.cumsum([0] + [len(points) for points in polylines]).tolist()
+    points = np.add(offset, np.concatenate(polylines) * (h_flip, 1)).tolist()
+    return [points[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
@@ -0,0 +1,247 @@
+import numpy as np
+
+from param_set import ParamSet
+from segment import Segment
+
+# Every segment's direction or length depends on these, so changing one of
+# them reshapes every vein.
+SEGMENT_PARAM_NAMES = {
+    "root_segment_len",
+    "segment_len_factor",
+    "root_segment_dir_const_x",
+    "root_segment_dir_const_y",
+    "root_segment_dir_linear_x",
+    "root_segment_dir_linear_y",
+    "root_segment_dir_quadratic_x",
+    "root_segment_dir_quadratic_y",
+    "segment_dir_linear_x",
+    "segment_dir_linear_y",
+    "segment_dir_quadratic_x",
+    "segment_dir_quadratic_y",
+    "segment_dir_a_x",
+    "segment_dir_a_y",
+    "segment_dir_b_x",
+    "segment_dir_b_y",
+    "segment_dir_c_x",
+    "segment_dir_c_y",
+    "segment_dir_d_x",
+    "segment_dir_d_y",
+}
+
+def param_to_array(parameters, prefix):
+    return np.stack(np.broadcast_arrays(
+        np.asarray(parameters[f"{prefix}_x"], dtype=float),
+        np.asarray(parameters[f"{prefix}_y"], dtype=float)), axis=-1)
+
+def quadratic_param_to_array(parameters, prefix, x):
+    x = np.asarray(x, dtype=float)[..., None]
+    return param_to_array(parameters, f"{prefix}_quadratic") * x**2 + \
+        param_to_array(parameters, f"{prefix}_linear") * x + \
+        param_to_array(parameters, f"{prefix}_const")
+
+def max_generations(parameters, index):
+    index = np.asarray(index, dtype=float)
+    return np.asarray(parameters['max_generations_quadratic']) * index**2 + \
+        np.asarray(parameters['max_generations_linear']) * index + \
+        np.asarray(parameters['max_generations_const'])
+
+def num_generations(parameters, index):
+    # A vein grows a child while its generation is below max_generations, so the
+    # last generation is the smallest integer not below it.
+    return np.maximum(np.ceil(max_generations(parameters, index)), 0).astype(int) + 1
+
+def segment_directions(parameters, index, generation):
+    """Unit direction for every broadcast (index, generation) pair.
+
+    Parameter values may be scalars or arrays, in which case they broadcast
+    against the leading axes of the result."""
+    i = np.asarray(index, dtype=float)[..., None]
+    g = np.asarray(generation, dtype=float)[..., None]
+    direction = quadratic_param_to_array(parameters, 'root_segment_dir', index) + \
+        param_to_array(parameters, 'segment_dir_quadratic') * g**2 + \
+        param_to_array(parameters, 'segment_dir_linear') * g + \
+        param_to_array(parameters, 'segment_dir_a') * i**2 * g**2 + \
+        param_to_array(parameters, 'segment_dir_b') * i**2 * g + \
+        param_to_array(parameters, 'segment_dir_c') * i * g**2 + \
+        param_to_array(parameters, 'segment_dir_d') * i * g
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return direction / np.linalg.norm(direction, axis=-1, keepdims=True)
+
+class VeinTree:
+    """Structure-of-arrays representation of the primary veins.
+
+    Every vein is an unbranched chain of segments. Segments are stored vein by
+    vein in generation order; the segments of the vein at zero-based position v
+    are `slice(vein_offsets[v], vein_offsets[v + 1])`."""
+
+    def __init__(
+            self,
+            positions:np.ndarray,
+            directions:np.ndarray,
+            lengths:np.ndarray,
+            indices:np.ndarray,
+            generations:np.ndarray,
+            vein_offsets:np.ndarray):
+        self.positions = positions
+        self.directions = directions
+        self.lengths = lengths
+        self.indices = indices
+        self.generations = generations
+        self.vein_offsets = vein_offsets
+        self._root_segments: list[Segment] | None = None
+
+    @classmethod
+    def from_parameters(cls, parameters:ParamSet, vein_index:np.ndarray | None = None) -> 'VeinTree':
+        """Grow every vein, or only the veins with the given one-based indices."""
+        if vein_index is None:
+            vein_index = np.arange(1, int(parameters['num_root_segments']) + 1)
+        num_veins = len(vein_index)
+        counts = num_generations(parameters, vein_index)
+        max_count = int(counts.max()) if num_veins > 0 else 0
+
+        # Evaluate every (index, generation) pair on a rectangular grid and
+        # mask off the generations each vein never reaches.
+        generation = np.arange(max_count)
+        mask = generation[None, :] < counts[:, None]
+        directions = segment_directions(parameters, vein_index[:, None], generation[None, :])
+        lengths = np.full(max_count, float(parameters['segment_len_factor']))
+        lengths[:1] = parameters['root_segment_len']
+        lengths = np.cumprod(lengths)
+        steps = directions * lengths[None, :, None]
+        positions = np.empty_like(steps)
+        positions[:, :1] = quadratic_param_to_array(
+            parameters, 'root_segment_pos', vein_index)[:, None, :]
+        positions[:, 1:] = steps[:, :-1]
+        np.cumsum(positions, axis=1, out=positions)
+
+        vein_offsets = np.zeros(num_veins + 1, dtype=int)
+        np.cumsum(counts, out=vein_offsets[1:])
+        return cls(
+            positions=positions[mask],
+            directions=directions[mask],
+            lengths=np.broadcast_to(lengths, mask.shape)[mask],
+            indices=np.broadcast_to(vein_index[:, None], mask.shape)[mask],
+            generations=np.broadcast_to(generation, mask.shape)[mask],
+            vein_offsets=vein_offsets)
+
+    def updated(self, parameters:ParamSet, changed:set[str]) -> tuple['VeinTree', np.ndarray]:
+        """This tree after the `changed` parameters took their values in
+        `parameters`, with a mask of the veins whose segments changed.
+
+        Only veins whose output changes are grown again. A vein keeps its
+        segments when its root and length are unchanged, and a vein whose root
+        moved keeps its directions and lengths and is just laid out again."""
+        num_veins = int(parameters['num_root_segments'])
+        vein_index = np.arange(1, num_veins + 1)
+        counts = num_generations(parameters, vein_index)
+        roots = quadratic_param_to_array(parameters, 'root_segment_pos', vein_index)
+
+        num_kept = min(num_veins, self.num_veins)
+        reusable = np.zeros(num_veins, dtype=bool)
+        if not changed & SEGMENT_PARAM_NAMES:
+            reusable[:num_kept] = counts[:num_kept] == self.vein_lengths()[:num_kept]
+        moved = np.zeros(num_veins, dtype=bool)
+        moved[:num_kept] = np.any(roots[:num_kept] != self.root_positions[:num_kept], axis=1)
+        moved &= reusable
+
+        regrown = np.nonzero(~reusable)[0]
+        grown = VeinTree.from_parameters(parameters, vein_index[regrown])
+        pieces = []
+        for v in range(num_veins):
+            if reusable[v]:
+                tree, s = self, self.vein_slice(v)
+            else:
+                tree, s = grown, grown.vein_slice(int(np.searchsorted(regrown, v)))
+            positions = tree.positions[s]
+            if moved[v]:
+                steps = tree.directions[s] * tree.lengths[s, None]
+                positions = np.empty_like(steps)
+                positions[:1] = roots[v]
+                positions[1:] = steps[:-1]
+                np.cumsum(positions, axis=0, out=positions)
+            pieces.append((
+                positions, tree.directions[s], tree.lengths[s],
+                tree.indices[s], tree.generations[s]))
+
+        vein_offsets = np.zeros(num_veins + 1, dtype=int)
+        np.cumsum([len(piece[0]) for piece in pieces], out=vein_offsets[1:])
+        if pieces:
+            positions, directions, lengths, indices, generations = \
+                (np.concatenate(arrays) for arrays in zip(*pieces))
+        else:
+            positions, directions = np.empty((0, 2)), np.empty((0, 2))
+            lengths, indices, generations = np.empty(0), np.empty(0, int), np.empty(0, int)
+        tree = VeinTree(positions, directions, lengths, indices, generations, vein_offsets)
+        return tree, ~reusable | moved
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """The tree's arrays by name; `VeinTree(**arrays)` rebuilds it."""
+        return {
+            'positions': self.positions,
+            'directions': self.directions,
+            'lengths': self.lengths,
+            'indices': self.indices,
+            'generations': self.generations,
+            'vein_offsets': self.vein_offsets,
+        }
+
+    def changed_veins(self, previous:'VeinTree') -> np.ndarray:
+        """Mask of this tree's veins that differ from the same vein of `previous`."""
+        result = np.ones(self.num_veins, dtype=bool)
+        for v in range(min(self.num_veins, previous.num_veins)):
+            s, t = self.vein_slice(v), previous.vein_slice(v)
+            result[v] = not (
+                np.array_equal(self.positions[s], previous.positions[t]) and
+                np.array_equal(self.directions[s], previous.directions[t]) and
+                np.array_equal(self.lengths[s], previous.lengths[t]))
+        return result
+
+    @property
+    def num_veins(self) -> int:
+        return len(self.vein_offsets) - 1
+
+    @property
+    def endpoints(self) -> np.ndarray:
+        return self.positions + self.directions * self.lengths[:, None]
+
+    @property
+    def root_positions(self) -> np.ndarray:
+        return self.positions[self.vein_offsets[:-1]]
+
+    @property
+    def tip_endpoints(self) -> np.ndarray:
+        tips = self.vein_offsets[1:] - 1
+        return self.positions[tips] + self.directions[tips] * self.lengths[tips, None]
+
+    def vein_lengths(self) -> np.ndarray:
+        """Number of segments in each vein, including the root segment."""
+        return np.diff(self.vein_offsets)
+
+    def vein_slice(self, vein:int) -> slice:
+        return slice(self.vein_offsets[vein], self.vein_offsets[vein + 1])
+
+    def vein_points(self, vein:int) -> np.ndarray:
+        """Polyline through every segment start and the tip endpoint of a vein."""
+        s = self.vein_slice(vein)
+        tip = self.positions[s.stop - 1] + self.directions[s.stop - 1] * self.lengths[s.stop - 1]
+        return np.concatenate([self.positions[s], tip[None, :]])
+
+    def root_segments(self) -> list[Segment]:
+        """Lazily built `Segment` view of the tree for callers that walk it."""
+        if self._root_segments is None:
+            self._root_segments = [self._build_segments(v) for v in range(self.num_veins)]
+        return self._root_segments
+
+    def _build_segments(self, vein:int) -> Segment:
+        parent:Segment | None = None
+        for i in range(self.vein_offsets[vein + 1] - 1, self.vein_offsets[vein] - 1, -1):
+            segment = Segment(
+                position=self.positions[i].copy(),
+                direction=self.directions[i].copy(),
+                length=float(self.lengths[i]),
+                index=int(self.indices[i]),
+                generation=int(self.generations[i]),
+                children=[parent] if parent is not None else [])
+            parent = segment
+        assert parent is not None
+        return parent
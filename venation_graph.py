@@ -0,0 +1,286 @@
+import numpy as np
+import shapely
+from shapely import STRtree, get_coordinates, get_exterior_ring, get_num_coordinates, \
+    line_locate_point
+
+from polygon_edges import EDGE_DECIMALS
+from vein_renderer import VeinRenderer
+
+VEIN = 0
+CROSS_VEIN = 1
+
+# Cell corners this close to a vein are taken to lie on it.
+ON_VEIN_DISTANCE = 10.0 ** -EDGE_DECIMALS
+
+class VenationGraph:
+    """The whole wing, both halves, as one planar graph backed by arrays.
+
+    Vertices are every vein point and cell corner, merged where they coincide.
+    Each edge is stored once, as a vein or a cross vein. Veins are split
+    wherever a cell edge meets them, so an edge only ever joins neighbouring
+    vertices. Adjacency is in CSR form: the neighbours of vertex `v` are
+    `adjacent_vertices[adjacency_offsets[v]:adjacency_offsets[v + 1]]`. Each
+    face is one Voronoi cell, with its corners stored the same way. Sides are
+    given as the `h_flip` used to draw them: -1 for the left half, whose x
+    coordinates are negated, and 1 for the right half.
+
+    Counts and lengths are worked out up front, so lookups by vertex, face or
+    region take constant time. `nearest_edge` uses an STR-tree."""
+
+    def __init__(
+            self,
+            vertices:np.ndarray,
+            edges:np.ndarray,
+            edge_kinds:np.ndarray,
+            edge_sides:np.ndarray,
+            edge_veins:np.ndarray,
+            face_offsets:np.ndarray,
+            face_vertices:np.ndarray,
+            face_sides:np.ndarray,
+            face_regions:np.ndarray,
+            num_veins:int):
+        self.vertices = vertices
+        self.edges = edges
+        self.edge_kinds = edge_kinds
+        self.edge_sides = edge_sides
+        self.edge_veins = edge_veins
+        self.face_offsets = face_offsets
+        self.face_vertices = face_vertices
+        self.face_sides = face_sides
+        self.face_regions = face_regions
+        self.num_veins = num_veins
+
+        # Both directions of every edge, grouped by the vertex they leave.
+        sources = np.concatenate([edges[:, 0], edges[:, 1]])
+        order = np.argsort(sources, kind='stable')
+        self.adjacent_vertices = np.concatenate([edges[:, 1], edges[:, 0]])[order]
+        self.adjacent_edges = np.tile(np.arange(len(edges)), 2)[order]
+        self.adjacency_offsets = np.zeros(len(vertices) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(vertices)), out=self.adjacency_offsets[1:])
+        self.degrees = np.diff(self.adjacency_offsets)
+
+        segments = vertices[edges]
+        self.edge_lengths = np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1)
+        is_vein = edge_kinds == VEIN
+        self.vein_lengths = np.zeros((2, num_veins))
+        np.add.at(self.vein_lengths, ((edge_sides[is_vein] > 0).astype(int), edge_veins[is_vein]),
+                  self.edge_lengths[is_vein])
+        self.total_vein_length = float(self.vein_lengths.sum())
+        self.region_cell_counts = np.zeros((2, max(num_veins - 1, 0)), dtype=np.int64)
+        np.add.at(self.region_cell_counts, ((face_sides > 0).astype(int), face_regions), 1)
+        self._strtree: STRtree | None = None
+
+    @classmethod
+    def from_vein_renderer(cls, vein_renderer:VeinRenderer) -> 'VenationGraph':
+        """The graph of a wing whose cross veins have been generated."""
+        veins = vein_renderer.vein_polylines()
+        left, right = vein_renderer.interveinal_regions
+        sides = []
+        vein_lines = []
+        cells = []
+        for h_flip, regions in ((-1, left), (1, right)):
+            flip = np.array([h_flip, 1])
+            vein_lines.extend(points * flip for points in veins)
+            for region_number, region in enumerate(regions):
+                for cell in region.voronoi_polygons:
+                    cells.append(shapely.transform(cell, lambda coords, f=flip: coords * f))
+                    sides.append((h_flip, region_number))
+        return cls._build(vein_lines, cells, sides, len(veins))
+
+    @classmethod
+    def from_arrays(cls, arrays:dict[str, np.ndarray]) -> 'VenationGraph':
+        return cls(
+            arrays['vertices'],
+            arrays['edges'].astype(np.int64),
+            arrays['edge_kinds'],
+            arrays['edge_sides'],
+            arrays['edge_veins'],
+            arrays['face_offsets'].astype(np.int64),
+            arrays['face_vertices'].astype(np.int64),
+            arrays['face_sides'],
+            arrays['face_regions'],
+            int(arrays['num_veins']))
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Everything needed to rebuild the graph, in the smallest integer
+        types that fit. Derived arrays such as the adjacency are left out."""
+        index_type = np.int32 if len(self.vertices) < 2 ** 31 else np.int64
+        return {
+            'vertices': self.vertices,
+            'edges': self.edges.astype(index_type),
+            'edge_kinds': self.edge_kinds,
+            'edge_sides': self.edge_sides,
+            'edge_veins': self.edge_veins,
+            'face_offsets': self.face_offsets.astype(index_type),
+            'face_vertices': self.face_vertices.astype(index_type),
+            'face_sides': self.face_sides,
+            'face_regions': self.face_regions,
+            'num_veins': np.array(self.num_veins),
+        }
+
+    def save(self, filename:str):
+        np.savez_compressed(filename, **self.to_arrays())
+
+    @classmethod
+    def load(cls, filename:str) -> 'VenationGraph':
+        with np.load(filename) as arrays:
+            return cls.from_arrays(dict(arrays))
+
+    @property
+    def num_vertices(self) -> int:
+        return len(self.vertices)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.edges)
+
+    @property
+    def num_faces(self) -> int:
+        return len(self.face_sides)
+
+    def neighbours(self, vertex:int) -> np.ndarray:
+        start, end = self.adjacency_offsets[vertex:vertex + 2]
+        return self.adjacent_vertices[start:end]
+
+    def incident_edges(self, vertex:int) -> np.ndarray:
+        start, end = self.adjacency_offsets[vertex:vertex + 2]
+        return self.adjacent_edges[start:end]
+
+    def degree(self, vertex:int) -> int:
+        return int(self.degrees[vertex])
+
+    def face(self, face:int) -> np.ndarray:
+        """The vertices around a cell, without repeating the first."""
+        return self.face_vertices[self.face_offsets[face]:self.face_offsets[face + 1]]
+
+    def cell_count(self, side:int, region:int) -> int:
+        """Cells in the region between veins `region` and `region + 1`."""
+        return int(self.region_cell_counts[int(side > 0), region])
+
+    def vein_length(self, side:int, vein:int) -> float:
+        return float(self.vein_lengths[int(side > 0), vein])
+
+    def vein_junctions(self) -> np.ndarray:
+        """Vertices on a vein where a cross vein meets it."""
+        is_vein = self.edge_kinds == VEIN
+        on_vein = np.zeros(self.num_vertices, dtype=bool)
+        on_vein[self.edges[is_vein].ravel()] = True
+        on_cross_vein = np.zeros(self.num_vertices, dtype=bool)
+        on_cross_vein[self.edges[~is_vein].ravel()] = True
+        return np.nonzero(on_vein & on_cross_vein)[0]
+
+    def nearest_edge(self, x:float, y:float) -> int:
+        """The edge closest to a point in wing coordinates."""
+        if self._strtree is None:
+            self._strtree = STRtree(shapely.linestrings(self.vertices[self.edges]))
+        return int(self._strtree.query_nearest(shapely.points(x, y))[0])
+
+    @classmethod
+    def _build(
+            cls,
+            vein_lines:list[np.ndarray],
+            cells:list,
+            sides:list[tuple[int, int]],
+            num_veins:int) -> 'VenationGraph':
+        rings = get_exterior_ring(np.asarray(cells, dtype=object))
+        num_corners = get_num_coordinates(rings) - 1
+        ring_coords, ring_index = get_coordinates(rings, return_index=True)
+        # Rings repeat their first point at the end.
+        is_corner = np.ones(len(ring_coords), dtype=bool)
+        is_corner[np.cumsum(num_corners + 1) - 1] = False
+        corners = ring_coords[is_corner]
+        corner_ring = ring_index[is_corner]
+        face_sides = np.array([side for side, _ in sides], dtype=np.int8)
+        face_regions = np.array([region for _, region in sides], dtype=np.int16)
+
+        vein_points = np.concatenate(vein_lines) if vein_lines else np.empty((0, 2))
+
+        all_points = np.concatenate([vein_points, corners])
+        keys = np.round(all_points, EDGE_DECIMALS)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        # Numbered in the order they're first seen, so the graph is stable.
+        order = np.argsort(first)
+        renumber = np.empty_like(order)
+        renumber[order] = np.arange(len(order))
+        vertices = all_points[first[order]]
+        point_vertex = renumber[inverse]
+        corner_vertex = point_vertex[len(vein_points):]
+
+        # Every vertex lying on a vein, in order along it, splits the vein.
+        lines = np.asarray([shapely.linestrings(points) for points in vein_lines], dtype=object)
+        vertex_points = shapely.points(vertices)
+        line_number, vertex = STRtree(vertex_points).query(
+            lines, predicate='dwithin', distance=ON_VEIN_DISTANCE)
+        along = line_locate_point(lines[line_number], vertex_points[vertex])
+        order = np.lexsort((along, line_number))
+        line_number, vertex = line_number[order], vertex[order]
+        joined = line_number[:-1] == line_number[1:]
+        vein_edges = np.stack([vertex[:-1][joined], vertex[1:][joined]], axis=1)
+        vein_edge_line = line_number[:-1][joined]
+        vertex_line = np.full(len(vertices), -1)
+        vertex_line[vertex] = line_number
+        vertex_position = np.full(len(vertices), -1)
+        vertex_position[vertex] = np.arange(len(vertex))
+
+        # A cell side along a vein can pass vertices of the cells across the
+        # vein, so they're added to the cell to make its edges the vein's.
+        face_vertices = []
+        corner_offsets = np.concatenate([[0], np.cumsum(num_corners)])
+        face_offsets = np.zeros(len(num_corners) + 1, dtype=np.int64)
+        for face in range(len(num_corners)):
+            ring = corner_vertex[corner_offsets[face]:corner_offsets[face + 1]]
+            face_ring = []
+            for u, w in zip(ring, np.roll(ring, -1)):
+                if not face_ring or face_ring[-1] != u:
+                    face_ring.append(u)
+                line = vertex_line[u]
+                if line < 0 or line != vertex_line[w]:
+                    continue
+                pu, pw = vertex_position[u], vertex_position[w]
+                between = vertex[pu + 1:pw] if pu < pw else vertex[pw + 1:pu][::-1]
+                if len(between) > 0 and shapely.dwithin(
+                        lines[line], shapely.points((vertices[u] + vertices[w]) / 2),
+                        ON_VEIN_DISTANCE):
+                    face_ring.extend(between)
+            if len(face_ring) > 1 and face_ring[-1] == face_ring[0]:
+                face_ring.pop()
+            face_vertices.extend(face_ring)
+            face_offsets[face + 1] = len(face_vertices)
+        face_vertices = np.array(face_vertices, dtype=np.int64)
+
+        # Cell edges join consecutive vertices, wrapping round each face.
+        face_length = np.diff(face_offsets)
+        next_vertex = np.arange(len(face_vertices)) + 1
+        next_vertex[face_offsets[1:][face_length > 0] - 1] = face_offsets[:-1][face_length > 0]
+        cell_edges = np.stack([face_vertices, face_vertices[next_vertex]], axis=1)
+        cell_edge_face = np.repeat(np.arange(len(face_length)), face_length)
+
+        # A cell edge along a vein is the same as the vein's edge, which is
+        # listed first so it's the one kept.
+        num_lines_per_side = max(num_veins, 1)
+        edges = np.sort(np.concatenate([vein_edges, cell_edges]), axis=1)
+        kinds = np.concatenate([
+            np.full(len(vein_edges), VEIN, dtype=np.int8),
+            np.full(len(cell_edges), CROSS_VEIN, dtype=np.int8)])
+        edge_sides = np.concatenate([
+            np.where(vein_edge_line < num_lines_per_side, -1, 1).astype(np.int8),
+            face_sides[cell_edge_face]])
+        edge_veins = np.concatenate([
+            vein_edge_line % num_lines_per_side,
+            np.full(len(cell_edges), -1)]).astype(np.int16)
+        nondegenerate = edges[:, 0] != edges[:, 1]
+        _, first = np.unique(edges[nondegenerate], axis=0, return_index=True)
+        keep = np.nonzero(nondegenerate)[0][np.sort(first)]
+
+        return cls(
+            vertices,
+            edges[keep],
+            kinds[keep],
+            edge_sides[keep],
+            edge_veins[keep],
+            face_offsets,
+            face_vertices,
+            face_sides,
+            face_regions,
+            num_veins)
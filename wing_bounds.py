@@ -0,0 +1,67 @@
+from typing import NamedTuple
+
+import numpy as np
+from shapely.geometry import Polygon
+
+SCREEN_WIDTH = 1600
+SCREEN_HEIGHT = 900
+
+class BoundsRect(NamedTuple):
+    """An axis-aligned rectangle for the geometry code, which doesn't need
+    pygame. It has the same corner names as `pygame.Rect`, and pygame accepts
+    it anywhere it takes a rect."""
+    x: int
+    y: int
+    width: int
+    height: int
+
+    @property
+    def left(self) -> int:
+        return self.x
+
+    @property
+    def top(self) -> int:
+        return self.y
+
+    @property
+    def right(self) -> int:
+        return self.x + self.width
+
+    @property
+    def bottom(self) -> int:
+        return self.y + self.height
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return (self.width, self.height)
+
+    @property
+    def topleft(self) -> tuple[int, int]:
+        return (self.left, self.top)
+
+    @property
+    def topright(self) -> tuple[int, int]:
+        return (self.right, self.top)
+
+    @property
+    def bottomright(self) -> tuple[int, int]:
+        return (self.right, self.bottom)
+
+    @property
+    def bottomleft(self) -> tuple[int, int]:
+        return (self.left, self.bottom)
+
+# Truncated to whole pixels, as pygame.Rect did.
+TARGET_BOX = BoundsRect(
+  int(SCREEN_WIDTH/2), 20, int(SCREEN_WIDTH/2 - 20), SCREEN_HEIGHT - 40)
+BASE_TARGET_BOX = BoundsRect(
+  int(SCREEN_WIDTH/2), int(SCREEN_HEIGHT * 0.2), 200, int(SCREEN_HEIGHT * 0.6))
+RENDER_OFFSET = (SCREEN_WIDTH/2, 0)
+
+def bounds_polygon(bounds_rect:BoundsRect, offset) -> Polygon:
+    """The rect as a polygon in wing coordinates, i.e. with offset removed."""
+    return Polygon([
+        np.subtract(bounds_rect.topleft, offset),
+        np.subtract(bounds_rect.topright, offset),
+        np.subtract(bounds_rect.bottomright, offset),
+        np.subtract(bounds_rect.bottomleft, offset)])
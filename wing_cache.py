@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from param_set import ParamSet
+from pipeline_stages import PARAM_STAGES, ROOT_PLACEMENT, VEIN_GROWTH
+
+# Bump when anything stored in the cache changes shape or meaning.
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+VEIN_PARAM_NAMES = sorted(
+    name for name, stage in PARAM_STAGES.items() if stage in (ROOT_PLACEMENT, VEIN_GROWTH))
+
+Entry = dict[str, np.ndarray]
+
+def _digest(*parts) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(CACHE_VERSION).encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            # The shape keeps arrays hashed back to back apart.
+            h.update(json.dumps(part.shape).encode())
+            h.update(np.ascontiguousarray(part, dtype=float).tobytes())
+        else:
+            h.update(json.dumps(part).encode())
+    return h.hexdigest()
+
+def vein_key(parameters:ParamSet) -> str:
+    """Key for the vein geometry, which only the root placement and vein
+    growth parameters affect. Ints and floats with equal values hash alike."""
+    return "veins-" + _digest([[name, float(parameters[name])] for name in VEIN_PARAM_NAMES]) # type: ignore[literal-required]
+
+def region_key(
+        vein_points0:np.ndarray,
+        vein_points1:np.ndarray,
+        parameters:ParamSet,
+        side:str,
+        region_number:int) -> str:
+    """Key for the relaxed cells of one interveinal region. The region is
+    identified by the coordinates of its two veins, so it's found again
+    whichever parameters produced them, along with everything its random
+    stream is drawn from."""
+    return "region-" + _digest(
+        vein_points0, vein_points1,
+        [float(parameters['cross_vein_density']), int(parameters['cross_vein_seed']),
+         side, region_number])
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    disk_hits: int
+    entries: int
+    memory_bytes: int
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (f"{self.hits} hits ({self.disk_hits} from disk), {self.misses} misses "
+                f"({rate:.1%} hit rate), {self.entries} entries, "
+                f"{self.memory_bytes / (1024 * 1024):.1f} MiB")
+
+class WingCache:
+    """Content-addressed store of generated wing data.
+
+    Entries are dictionaries of NumPy arrays. The most recently used entries
+    are kept in memory up to `max_bytes`. With a `directory`, every entry is
+    also written there as a compressed .npz file, which outlives the process
+    and can be shared between batch workers."""
+
+    def __init__(self, max_bytes:int = DEFAULT_MAX_BYTES, directory:str | None = None):
+        self._max_bytes = max_bytes
+        self._directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._entries: OrderedDict[str, Entry] = OrderedDict()
+        self._memory_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._disk_hits = 0
+        self._lock = threading.Lock()
+
+    def get(self, key:str) -> Entry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._disk_hits += 1
+            self._insert(key, entry)
+        return entry
+
+    def put(self, key:str, entry:Entry):
+        entry = {name: np.asarray(value) for name, value in entry.items()}
+        with self._lock:
+            self._insert(key, entry)
+        self._save(key, entry)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                disk_hits=self._disk_hits,
+                entries=len(self._entries),
+                memory_bytes=self._memory_bytes)
+
+    def clear(self):
+        """Empty the in-memory layer. Files on disk are left alone."""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+    def _insert(self, key:str, entry:Entry):
+        if key in self._entries:
+            self._memory_bytes -= _entry_bytes(self._entries.pop(key))
+        self._entries[key] = entry
+        self._memory_bytes += _entry_bytes(entry)
+        while self._memory_bytes > self._max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= _entry_bytes(evicted)
+
+    def _path(self, key:str) -> str:
+        assert self._directory is not None
+        return os.path.join(self._directory, f"{key}.npz")
+
+    def _load(self, key:str) -> Entry | None:
+        if self._directory is None:
+            return None
+        try:
+            with np.load(self._path(key)) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key:str, entry:Entry):
+        if self._directory is None or os.path.exists(self._path(key)):
+            return
+        # Written under a temporary name and renamed so readers in other
+        # processes never see a partial file.
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **entry)
+        os.replace(temp_path, self._path(key))
+
+def _entry_bytes(entry:Entry) -> int:
+    return sum(value.nbytes for value in entry.values())
@@ -0,0 +1,26 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+import multiprocessing
+import os
+
+_worker_pool: Executor | None = None
+
+def get_worker_pool() -> Executor | None:
+    """Shared process pool, or None when there's only one core to run on.
+
+    Workers are spawned rather than forked so they never inherit the pygame
+    display from the parent process."""
+    global _worker_pool
+    if _worker_pool is None:
+        cpu_count = os.cpu_count() or 1
+        if cpu_count <= 1:
+            return None
+        _worker_pool = ProcessPoolExecutor(
+            max_workers=cpu_count,
+            mp_context=multiprocessing.get_context('spawn'))
+    return _worker_pool
+
+def shutdown_worker_pool():
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.shutdown(cancel_futures=True)
+        _worker_pool = None